@@ -1,42 +1,99 @@
 import cv2 as cv
-import numpy as np
-from matplotlib import pyplot as plt
+import argparse
+import csv
+import json
 
 
-def motionDetection():
-    cap = cv.VideoCapture("./img/vtest.avi")
+def findMotion(frame1, frame2):
+    diff = cv.absdiff(frame1, frame2)
+    diff_gray = cv.cvtColor(diff, cv.COLOR_BGR2GRAY)
+    blur = cv.GaussianBlur(diff_gray, (5, 5), 0)
+    _, thresh = cv.threshold(blur, 20, 255, cv.THRESH_BINARY)
+    dilated = cv.dilate(thresh, None, iterations=3)
+    contours, _ = cv.findContours(
+        dilated, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        if cv.contourArea(contour) < 900:
+            continue
+        boxes.append(cv.boundingRect(contour))
+    return boxes
+
+
+def drawMotion(frame, boxes):
+    for (x, y, w, h) in boxes:
+        cv.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+    if boxes:
+        cv.putText(frame, "Status: {}".format('Movement'), (10, 20), cv.FONT_HERSHEY_SIMPLEX,
+                   1, (255, 0, 0), 3)
+
+    # cv.drawContours(frame1, contours, -1, (0, 255, 0), 2)
+    return frame
+
+
+def writeResult(results, index, timestamp, boxes):
+    # results is a (file, csv writer or None) pair from openResults
+    resultsFile, writer = results
+    record = {'frame': index, 'timestamp': round(timestamp, 3), 'movement': bool(boxes),
+              'boxes': [[int(v) for v in box] for box in boxes]}
+    if writer is not None:
+        writer.writerow(dict(record, boxes=json.dumps(record['boxes'])))
+    else:
+        resultsFile.write(json.dumps(record) + "\n")
+
+
+def openResults(path):
+    # JSON lines, or CSV when the path ends in .csv
+    resultsFile = open(path, "w", newline="")
+    writer = None
+    if path.lower().endswith(".csv"):
+        writer = csv.DictWriter(resultsFile, fieldnames=['frame', 'timestamp', 'movement', 'boxes'])
+        writer.writeheader()
+    return resultsFile, writer
+
+
+def motionDetection(video_path="./img/vtest.avi", headless=False, results_path=None, delay=50):
+    # headless runs never open a window or wait for keys, so frames are processed as
+    # fast as they decode; boxes are only drawn when they are shown
+    cap = cv.VideoCapture(video_path)
     ret, frame1 = cap.read()
     ret, frame2 = cap.read()
+    results = openResults(results_path) if results_path is not None else None
+    fps = cap.get(cv.CAP_PROP_FPS)
+    index = 0
 
-    while cap.isOpened():
-        diff = cv.absdiff(frame1, frame2)
-        diff_gray = cv.cvtColor(diff, cv.COLOR_BGR2GRAY)
-        blur = cv.GaussianBlur(diff_gray, (5, 5), 0)
-        _, thresh = cv.threshold(blur, 20, 255, cv.THRESH_BINARY)
-        dilated = cv.dilate(thresh, None, iterations=3)
-        contours, _ = cv.findContours(
-            dilated, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-
-        for contour in contours:
-            (x, y, w, h) = cv.boundingRect(contour)
-            if cv.contourArea(contour) < 900:
-                continue
-            cv.rectangle(frame1, (x, y), (x+w, y+h), (0, 255, 0), 2)
-            cv.putText(frame1, "Status: {}".format('Movement'), (10, 20), cv.FONT_HERSHEY_SIMPLEX,
-                       1, (255, 0, 0), 3)
-
-        # cv.drawContours(frame1, contours, -1, (0, 255, 0), 2)
-
-        cv.imshow("Video", frame1)
+    while cap.isOpened() and ret:
+        timestamp = index / fps if fps > 0 else 0.0
+        boxes = findMotion(frame1, frame2)
+        if results is not None:
+            writeResult(results, index, timestamp, boxes)
+
+        if not headless:
+            cv.imshow("Video", drawMotion(frame1, boxes))
         frame1 = frame2
         ret, frame2 = cap.read()
+        index += 1
 
-        if cv.waitKey(50) == 27:
+        if not headless and cv.waitKey(delay) == 27:
             break
 
     cap.release()
-    cv.destroyAllWindows()
+    if results is not None:
+        results[0].close()
+    if not headless:
+        cv.destroyAllWindows()
+
+
+def argsParser():
+    arg_parse = argparse.ArgumentParser()
+    arg_parse.add_argument("-v", "--video", default="./img/vtest.avi", help="path to Video File")
+    arg_parse.add_argument("--headless", action="store_true", help="run without any window or key handling, as fast as frames decode")
+    arg_parse.add_argument("-r", "--results", default=None, help="path to write per-frame results to (.jsonl, or .csv)")
+    arg_parse.add_argument("-d", "--delay", type=int, default=50, help="milliseconds to wait between displayed frames")
+    return vars(arg_parse.parse_args())
 
 
 if __name__ == "__main__":
-    motionDetection()
+    args = argsParser()
+    motionDetection(args["video"], args["headless"], args["results"], args["delay"])
@@ -2,10 +2,39 @@ import cv2
 import imutils
 import numpy as np
 import argparse
-#frame
-def detect(frame):
-    bounding_box_cordinates, weights =  HOGCV.detectMultiScale(frame, winStride = (4, 4), padding = (8, 8), scale = 0.5)
-    
+import concurrent.futures
+import csv
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from tracker import IOU_THRESHOLD, boxIou, peopleTracker
+
+FRAMES_QUEUED_PER_WORKER = 2
+BATCH_CHUNK_FRAMES = 300
+MOTION_THRESHOLD = 20
+MOTION_MIN_AREA = 150
+MOTION_PADDING = 32
+HOG_WINDOW = (64, 128)
+FULL_FRAME_FRACTION = 0.6
+COUNTING_LINE = 0.5
+TRACK_WARMUP_FRAMES = 30
+TRACK_ID_STRIDE = 100000
+
+def createHOG():
+    hog = cv2.HOGDescriptor()
+    hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    return hog
+
+def detectPeople(frame, hog=None):
+    if hog is None:
+        hog = HOGCV
+    bounding_box_cordinates, weights =  hog.detectMultiScale(frame, winStride = (4, 4), padding = (8, 8), scale = 0.5)
+    return bounding_box_cordinates
+
+def drawDetections(frame, bounding_box_cordinates):
     person = 1
     for x,y,w,h in bounding_box_cordinates:
         cv2.rectangle(frame, (x,y), (x+w,y+h), (0,255,0), 2)
@@ -14,70 +43,405 @@ def detect(frame):
     
     cv2.putText(frame, 'Status : Detecting ', (40,40), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255,0,0), 2)
     cv2.putText(frame, f'Total Persons : {person-1}', (40,70), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255,0,0), 2)
-    cv2.imshow('output', frame)
+    return frame
+
+def drawTracks(frame, people, tracker):
+    for personId, (x,y,w,h) in people:
+        cv2.rectangle(frame, (x,y), (x+w,y+h), (0,255,0), 2)
+        cv2.putText(frame, f'person {personId}', (x,y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255), 1)
 
+    cv2.putText(frame, 'Status : Detecting ', (40,40), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255,0,0), 2)
+    cv2.putText(frame, f'Total Persons : {len(people)}', (40,70), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255,0,0), 2)
+    if tracker.lineY is not None:
+        lineY = int(tracker.lineY)
+        cv2.line(frame, (0,lineY), (frame.shape[1],lineY), (0,255,255), 2)
+        cv2.putText(frame, f'In : {tracker.entered}  Out : {tracker.exited}', (40,100), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255,0,0), 2)
     return frame
 
-def detectByPathVideo(path, writer):
+def createTracker(frame, countingLine, firstId=1):
+    return peopleTracker(None if countingLine is None else countingLine * frame.shape[0], firstId=firstId)
+
+def getTimestamp(video, live):
+    # seconds into the file, or wall-clock time for a camera
+    if live:
+        return time.time()
+    return video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+def makeRecord(index, timestamp, people, entered=0, exited=0):
+    return {'frame': index, 'timestamp': round(timestamp, 3), 'count': len(people), 'in': entered, 'out': exited,
+            'boxes': [[int(personId)] + [int(v) for v in box] for personId, box in people]}
+
+class resultsWriter():
+    # per-frame results as JSON lines, or as CSV when the path ends in .csv (boxes are
+    # then a JSON list of [id, x, y, w, h] in one column)
+    FIELDS = ['frame', 'timestamp', 'count', 'in', 'out', 'boxes']
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.csv = None
+        if path.lower().endswith('.csv'):
+            self.csv = csv.DictWriter(self.file, fieldnames=self.FIELDS)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv is not None:
+            self.csv.writerow(dict(record, boxes=json.dumps(record['boxes'])))
+        else:
+            self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+
+def getFullFrameRegion(frame):
+    return [(0, 0, frame.shape[1], frame.shape[0])]
+
+def findMotionRegions(prevFrame, frame):
+    # same frame differencing as Motion Detection/main.py: absdiff, blur, threshold, dilate.
+    # A slow walker in plain clothing only changes thin slivers along their edges, so the
+    # minimum contour area only rejects speckle noise
+    diff = cv2.absdiff(prevFrame, frame)
+    diff_gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(diff_gray, (5, 5), 0)
+    _, thresh = cv2.threshold(blur, MOTION_THRESHOLD, 255, cv2.THRESH_BINARY)
+    dilated = cv2.dilate(thresh, None, iterations=3)
+    contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    regions = [cv2.boundingRect(contour) for contour in contours if cv2.contourArea(contour) >= MOTION_MIN_AREA]
+    return padAndMergeRegions(regions, frame.shape)
+
+def padAndMergeRegions(regions, frameShape, padding=MOTION_PADDING):
+    # every region is padded and grown to at least one HOG window, then overlapping regions
+    # are merged so no area is searched twice
+    frameH, frameW = frameShape[:2]
+    boxes = []
+    for x,y,w,h in regions:
+        centreX, centreY = x + w / 2, y + h / 2
+        w = max(w + 2 * padding, HOG_WINDOW[0])
+        h = max(h + 2 * padding, HOG_WINDOW[1])
+        boxes.append([max(0, int(centreX - w / 2)), max(0, int(centreY - h / 2)),
+                      min(frameW, int(centreX + w / 2)), min(frameH, int(centreY + h / 2))])
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    # when most of the frame moved a single full-frame pass is cheaper than many crops
+    if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes) > FULL_FRAME_FRACTION * frameW * frameH:
+        return [(0, 0, frameW, frameH)]
+    return [(x0, y0, x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes]
+
+def detectPeopleInRegions(frame, regions, hog=None):
+    found = [np.zeros((0, 4), dtype=int)]
+    for x,y,w,h in regions:
+        bounding_box_cordinates = detectPeople(frame[y:y+h, x:x+w], hog)
+        if len(bounding_box_cordinates) > 0:
+            found.append(np.asarray(bounding_box_cordinates).reshape(-1, 4) + [x, y, 0, 0])
+    return np.concatenate(found)
+
+def boxesIntersect(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def boxInside(a, b):
+    return b[0] <= a[0] and b[1] <= a[1] and a[0] + a[2] <= b[0] + b[2] and a[1] + a[3] <= b[1] + b[3]
+
+def mergeWithStaticDetections(prevBoxes, regions, boxes, frame=None, hog=None):
+    # people found earlier that do not touch any changed region have not moved and are
+    # kept; a box inside a searched region is replaced by the new detections there. A box
+    # the regions only partly cover (a slow walker in plain clothing only changes thin
+    # edges) is searched again over its own area, unless a new detection already overlaps
+    # it. Static frames have no regions and simply reuse the previous result
+    kept, partial = [], []
+    for box in prevBoxes:
+        touching = [region for region in regions if boxesIntersect(box, region)]
+        if not touching:
+            kept.append(box)
+        elif not any(boxInside(box, region) for region in touching) and \
+                not any(boxesIntersect(box, newBox) for newBox in boxes):
+            partial.append(box)
+    found = [np.asarray(kept, dtype=int).reshape(-1, 4), boxes]
+    if partial and frame is not None:
+        found.append(detectPeopleInRegions(frame, padAndMergeRegions(partial, frame.shape), hog))
+    return np.concatenate(found)
+
+def readFrames(video, frameQueue, stopEvent, numWorkers, resizeWidth, dropFrames, motionGate, detectEvery):
+    # reader stage: decodes frames and numbers them. With dropFrames (live camera)
+    # a frame is skipped when the detectors are behind, so they always work on recent frames.
+    # Only every detectEvery-th frame is sent for detection (regions is None otherwise); with
+    # motionGate it carries the regions that changed since the previous detected frame
+    index = 0
+    prevFrame = None
+    while not stopEvent.is_set():
+        check, frame = video.read()
+        if not check:
+            break
+        timestamp = getTimestamp(video, dropFrames)
+        if resizeWidth is not None:
+            frame = imutils.resize(frame , width=min(resizeWidth,frame.shape[1]))
+        detectFrame = index % detectEvery == 0
+        if not detectFrame:
+            regions = None
+        elif motionGate and prevFrame is not None:
+            regions = findMotionRegions(prevFrame, frame)
+        else:
+            regions = getFullFrameRegion(frame)
+        if dropFrames:
+            try:
+                frameQueue.put_nowait((index, frame, regions, timestamp))
+            except queue.Full:
+                continue
+        else:
+            frameQueue.put((index, frame, regions, timestamp))
+        if detectFrame:
+            prevFrame = frame
+        index += 1
+    for _ in range(numWorkers):
+        frameQueue.put(None)
+
+def detectFrames(frameQueue, resultQueue):
+    # detection stage: every worker thread has its own HOGDescriptor; detectMultiScale
+    # releases the GIL so the workers run in parallel
+    hog = createHOG()
+    while True:
+        item = frameQueue.get()
+        if item is None:
+            resultQueue.put(None)
+            break
+        index, frame, regions, timestamp = item
+        regionBoxes = None if regions is None else detectPeopleInRegions(frame, regions, hog)
+        resultQueue.put((index, frame, regions, timestamp, regionBoxes))
+
+def detectByPipeline(video, writer, numWorkers, resizeWidth=None, dropFrames=False, motionGate=False, detectEvery=1,
+                     countingLine=COUNTING_LINE, headless=False, results=None):
+    # reader thread -> detection worker threads -> ordered writer (this thread, which
+    # also owns the window and the tracker), connected by bounded queues. Headless runs
+    # never touch the GUI and only draw the overlay when an output video is written
+    queueSize = FRAMES_QUEUED_PER_WORKER * numWorkers
+    frameQueue = queue.Queue(maxsize=queueSize)
+    resultQueue = queue.Queue(maxsize=queueSize)
+    stopEvent = threading.Event()
+
+    threads = [threading.Thread(target=readFrames, args=(video, frameQueue, stopEvent, numWorkers, resizeWidth, dropFrames, motionGate, detectEvery), daemon=True)]
+    threads += [threading.Thread(target=detectFrames, args=(frameQueue, resultQueue), daemon=True) for _ in range(numWorkers)]
+    for thread in threads:
+        thread.start()
+
+    # results arrive out of order; they are held back until every earlier frame has been written
+    pending = []
+    nextIndex = 0
+    finishedWorkers = 0
+    boxes = np.zeros((0, 4), dtype=int)
+    tracker = None
+    # searches again around people the motion regions only partly cover
+    hog = createHOG() if motionGate else None
+    while finishedWorkers < numWorkers:
+        item = resultQueue.get()
+        if item is None:
+            finishedWorkers += 1
+            continue
+        if stopEvent.is_set():
+            continue
+        heapq.heappush(pending, (item[0], item))
+        while pending and pending[0][0] == nextIndex:
+            _, (index, frame, regions, timestamp, regionBoxes) = heapq.heappop(pending)
+            nextIndex += 1
+            if tracker is None:
+                tracker = createTracker(frame, countingLine)
+            if regionBoxes is None:
+                people = tracker.step()
+            else:
+                boxes = mergeWithStaticDetections(boxes, regions, regionBoxes, frame, hog)
+                people = tracker.step(boxes)
+            if results is not None:
+                results.write(makeRecord(index, timestamp, people, tracker.entered, tracker.exited))
+            if headless and writer is None:
+                continue
+
+            frame = drawTracks(frame, people, tracker)
+            if writer is not None:
+                writer.write(frame)
+            if headless:
+                continue
+
+            cv2.imshow('output', frame)
+            key = cv2.waitKey(1)
+            if key == ord('q'):
+                stopEvent.set()
+                break
+
+    for thread in threads:
+        thread.join()
+
+def detectByPathVideo(path, writer, numWorkers=1, motionGate=False, detectEvery=1, countingLine=COUNTING_LINE,
+                      headless=False, results=None):
 
     video = cv2.VideoCapture(path)
     check, frame = video.read()
     if check == False:
         print('Video Not Found. Please Enter a Valid Path (Full path of Video Should be Provided).')
         return
+    # the probe frame is not part of the results, so frame numbers and timestamps match the file
+    video.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
     print('Detecting people...')
-    while video.isOpened():
-        #check is True if reading was successful 
-        check, frame =  video.read()
-
-        if check:
-            frame = imutils.resize(frame , width=min(800,frame.shape[1]))
-            frame = detect(frame)
-            
-            if writer is not None:
-                writer.write(frame)
-            
-            key = cv2.waitKey(1)
-            if key== ord('q'):
-                break
-        else:
-            break
+    detectByPipeline(video, writer, numWorkers, resizeWidth=800, motionGate=motionGate, detectEvery=detectEvery,
+                     countingLine=countingLine, headless=headless, results=results)
     video.release()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
 
-def detectByCamera(writer):
+def detectByCamera(writer, numWorkers=1, motionGate=False, detectEvery=1, countingLine=COUNTING_LINE,
+                   headless=False, results=None):
     video = cv2.VideoCapture(0)
     print('Detecting people...')
 
-    while True:
-        check, frame = video.read()
-
-        frame = detect(frame)
-        if writer is not None:
-            writer.write(frame)
-
-        key = cv2.waitKey(1)
-        if key == ord('q'):
-                break
-
+    detectByPipeline(video, writer, numWorkers, dropFrames=True, motionGate=motionGate, detectEvery=detectEvery,
+                     countingLine=countingLine, headless=headless, results=results)
     video.release()
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.destroyAllWindows()
 
-def detectByPathImage(path, output_path):
+def detectByPathImage(path, output_path, headless=False, results=None):
     image = cv2.imread(path)
 
     image = imutils.resize(image, width = min(800, image.shape[1])) 
 
-    result_image = detect(image)
+    bounding_box_cordinates = detectPeople(image)
+    if results is not None:
+        people = [(person, box) for person, box in enumerate(bounding_box_cordinates, 1)]
+        results.write(makeRecord(0, 0.0, people))
+    if headless and output_path is None:
+        return
 
+    result_image = drawDetections(image, bounding_box_cordinates)
     if output_path is not None:
         cv2.imwrite(output_path, result_image)
+    if headless:
+        return
 
+    cv2.imshow('output', result_image)
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
 
+def initBatchWorker():
+    # every worker process builds its own HOGDescriptor once
+    global HOGCV
+    HOGCV = createHOG()
+
+def getFrameCount(path):
+    video = cv2.VideoCapture(path)
+    frameCount = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    if frameCount <= 0:
+        # some containers do not store the frame count, so the frames are counted
+        frameCount = 0
+        while video.grab():
+            frameCount += 1
+    video.release()
+    return frameCount
+
+def countPeopleInRange(path, start, stop, resizeWidth=800, motionGate=False, detectEvery=1, countingLine=COUNTING_LINE,
+                       chunkIndex=0):
+    # the tracker is warmed up on the frames before start, so people already in view at a
+    # chunk boundary keep their track; line crossings are only counted from start on. Each
+    # chunk hands out ids from its own range, and the people tracked on the last warm-up
+    # frame are returned so they can be matched to the previous chunk
+    warmupStart = max(0, start - TRACK_WARMUP_FRAMES)
+    warmupStart -= warmupStart % detectEvery
+    video = cv2.VideoCapture(path)
+    video.set(cv2.CAP_PROP_POS_FRAMES, warmupStart)
+    records = []
+    prevFrame = None
+    boxes = np.zeros((0, 4), dtype=int)
+    tracker = None
+    boundary = []
+    for index in range(warmupStart, stop):
+        check, frame = video.read()
+        if not check:
+            break
+        timestamp = getTimestamp(video, False)
+        frame = imutils.resize(frame , width=min(resizeWidth,frame.shape[1]))
+        if tracker is None:
+            tracker = createTracker(frame, countingLine, chunkIndex * TRACK_ID_STRIDE + 1)
+        if index == start:
+            tracker.resetCounts()
+        if index % detectEvery != 0:
+            people = tracker.step()
+        else:
+            if motionGate and prevFrame is not None:
+                regions = findMotionRegions(prevFrame, frame)
+            else:
+                regions = getFullFrameRegion(frame)
+            boxes = mergeWithStaticDetections(boxes, regions, detectPeopleInRegions(frame, regions), frame)
+            people = tracker.step(boxes)
+            prevFrame = frame
+        if index >= start:
+            records.append(makeRecord(index, timestamp, people, tracker.entered, tracker.exited))
+        elif index == start - 1:
+            boundary = people
+    video.release()
+    if tracker is None:
+        return records, 0, 0, boundary
+    return records, tracker.entered, tracker.exited, boundary
+
+def matchChunkIds(boundary, lastRecord):
+    # a chunk's people on its last warm-up frame take the id of the person they overlap
+    # most in the previous chunk's last frame, which is the same frame
+    ids = {}
+    if lastRecord is None:
+        return ids
+    pairs = [(boxIou(box, prev[1:]), personId, prev[0]) for personId, box in boundary for prev in lastRecord['boxes']]
+    pairs.sort(key=lambda pair: pair[0], reverse=True)
+    for iou, personId, prevId in pairs:
+        if iou < IOU_THRESHOLD:
+            break
+        if personId in ids or prevId in ids.values():
+            continue
+        ids[personId] = prevId
+    return ids
+
+def detectByPathVideoBatch(path, numWorkers, chunkFrames=BATCH_CHUNK_FRAMES, motionGate=False, detectEvery=1,
+                           countingLine=COUNTING_LINE):
+    # offline mode: the file is cut into frame ranges that are decoded and processed by
+    # separate processes; the per-frame records come back in frame order together with
+    # the total line crossings in and out
+    frameCount = getFrameCount(path)
+    if frameCount == 0:
+        print('Video Not Found. Please Enter a Valid Path (Full path of Video Should be Provided).')
+        return [], 0, 0
+
+    starts = list(range(0, frameCount, chunkFrames))
+    stops = starts[1:] + [frameCount]
+    records = []
+    entered = exited = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers, initializer=initBatchWorker) as executor:
+        numChunks = len(starts)
+        for chunkRecords, chunkEntered, chunkExited, boundary in executor.map(countPeopleInRange, [path] * numChunks, starts,
+                                                                              stops, [800] * numChunks,
+                                                                              [motionGate] * numChunks,
+                                                                              [detectEvery] * numChunks,
+                                                                              [countingLine] * numChunks,
+                                                                              range(numChunks)):
+            # the in/out totals in a chunk's records start from zero at the chunk, and people
+            # seen across the chunk boundary keep the id they had in the previous chunk
+            ids = matchChunkIds(boundary, records[-1] if records else None)
+            for record in chunkRecords:
+                record['in'] += entered
+                record['out'] += exited
+                record['boxes'] = [[ids.get(box[0], box[0])] + box[1:] for box in record['boxes']]
+            records.extend(chunkRecords)
+            entered += chunkEntered
+            exited += chunkExited
+    return records, entered, exited
+
 def humanDetector(args):
     image_path = args["image"]
     video_path = args['video']
@@ -87,16 +451,46 @@ def humanDetector(args):
     writer = None
     if args['output'] is not None and image_path is None:
         writer = cv2.VideoWriter(args['output'],cv2.VideoWriter_fourcc(*'MJPG'), 10, (600,600))
+    headless = args['headless']
+    results = None
+    if args['results'] is not None:
+        results = resultsWriter(args['results'])
+    try:
+        runDetector(args, camera, image_path, video_path, writer, headless, results)
+    finally:
+        if results is not None:
+            results.close()
+        if writer is not None:
+            writer.release()
+
+def runDetector(args, camera, image_path, video_path, writer, headless, results):
+    workers = args['workers']
+    if workers is None:
+        workers = os.cpu_count() or 1
+    detectEvery = max(1, args['detect_every'])
+    countingLine = args['line'] if 0 <= args['line'] <= 1 else None
 
     if camera:
         print('[INFO] Opening Web Cam.')
-        detectByCamera(writer)
+        detectByCamera(writer, workers, args['motion_gate'], detectEvery, countingLine, headless, results)
+    elif video_path is not None and args['batch']:
+        print('[INFO] Counting people in video from path with ' + str(workers) + ' processes.')
+        records, entered, exited = detectByPathVideoBatch(video_path, workers, motionGate=args['motion_gate'],
+                                                          detectEvery=detectEvery, countingLine=countingLine)
+        if results is not None:
+            for record in records:
+                results.write(record)
+        counts = [record['count'] for record in records]
+        if counts:
+            print(f'Frames : {len(counts)}, Max Persons : {max(counts)}, Mean Persons : {np.mean(counts):.2f}')
+            if countingLine is not None:
+                print(f'In : {entered}, Out : {exited}')
     elif video_path is not None:
         print('[INFO] Opening Video from path.')
-        detectByPathVideo(video_path, writer)
+        detectByPathVideo(video_path, writer, workers, args['motion_gate'], detectEvery, countingLine, headless, results)
     elif image_path is not None:
         print('[INFO] Opening Image from path.')
-        detectByPathImage(image_path, args['output'])
+        detectByPathImage(image_path, args['output'], headless, results)
 
 def argsParser():
     arg_parse = argparse.ArgumentParser()
@@ -104,13 +498,22 @@ def argsParser():
     arg_parse.add_argument("-i", "--image", default=None, help="path to Image File ")#command
     arg_parse.add_argument("-c", "--camera", default=False, help="Set true if you want to use the camera.")#command
     arg_parse.add_argument("-o", "--output", type=str, help="path to optional output video file")#command
+    arg_parse.add_argument("-w", "--workers", type=int, default=None, help="number of detection threads or processes (default: number of CPUs)")#command
+    arg_parse.add_argument("-b", "--batch", action="store_true", help="count people in a video file with a process per core, without display")#command
+    arg_parse.add_argument("-m", "--motion-gate", action="store_true", help="run detection only where the frame changed and reuse the previous result elsewhere")#command
+    arg_parse.add_argument("-k", "--detect-every", type=int, default=1, help="run detection every K frames and track people in between")#command
+    arg_parse.add_argument("-l", "--line", type=float, default=COUNTING_LINE, help="height of the in/out counting line as a fraction of the frame (negative to disable)")#command
+    arg_parse.add_argument("--headless", action="store_true", help="run without any window or key handling, as fast as frames decode")#command
+    arg_parse.add_argument("-r", "--results", type=str, default=None, help="path to write per-frame results to (.jsonl, or .csv)")#command
     args = vars(arg_parse.parse_args())
+    # batch mode only counts; frames are detected out of order in worker processes and never annotated
+    if args['batch'] and args['output'] is not None and args['video'] is not None and str(args['camera']) != 'true':
+        arg_parse.error("-o/--output is not supported with -b/--batch")
 
     return args
 
 if __name__ == "__main__":
-    HOGCV = cv2.HOGDescriptor()
-    HOGCV.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    HOGCV = createHOG()
 
     args = argsParser()
     humanDetector(args)
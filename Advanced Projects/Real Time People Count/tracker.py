@@ -0,0 +1,131 @@
+import numpy as np
+
+IOU_THRESHOLD = 0.3
+CENTROID_DISTANCE = 0.5
+MAX_MISSED = 2
+MIN_HITS = 2
+VELOCITY_WEIGHT = 0.5
+
+def boxIou(a, b):
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    inter = max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+def boxCentre(box):
+    return np.array([box[0] + box[2] / 2, box[1] + box[3] / 2])
+
+class personTrack():
+    def __init__(self, trackId, box, frameIndex):
+        self.id = trackId
+        self.box = np.array(box, dtype=float)
+        self.velocity = np.zeros(2)
+        self.lastCentre = boxCentre(self.box)
+        self.lastFrame = frameIndex
+        self.hits = 1
+        self.missed = 0
+        self.side = None
+
+    def predict(self):
+        # constant-velocity model: the box keeps moving by the last estimated pixels per frame
+        self.box[:2] += self.velocity
+
+    def correct(self, box, frameIndex):
+        centre = boxCentre(box)
+        measured = (centre - self.lastCentre) / max(1, frameIndex - self.lastFrame)
+        self.velocity = VELOCITY_WEIGHT * measured + (1 - VELOCITY_WEIGHT) * self.velocity
+        self.box = np.array(box, dtype=float)
+        self.lastCentre = centre
+        self.lastFrame = frameIndex
+        self.hits += 1
+        self.missed = 0
+
+class peopleTracker():
+    def __init__(self, lineY=None, iouThreshold=IOU_THRESHOLD, maxMissed=MAX_MISSED, minHits=MIN_HITS, firstId=1):
+        # lineY is the height of a horizontal counting line; a person whose centre moves
+        # down across it is counted in, up across it out. Ids are handed out from firstId on
+        self.lineY = lineY
+        self.iouThreshold = iouThreshold
+        self.maxMissed = maxMissed
+        self.minHits = minHits
+        self.tracks = []
+        self.nextId = firstId
+        self.frameIndex = -1
+        self.entered = 0
+        self.exited = 0
+
+    def step(self, boxes=None):
+        # advances one frame. Between detections (boxes is None) the tracks are only
+        # propagated; with detections they are associated and corrected
+        self.frameIndex += 1
+        for track in self.tracks:
+            track.predict()
+        if boxes is not None:
+            self.associate([np.asarray(box, dtype=float) for box in boxes])
+        self.countCrossings()
+        return self.people()
+
+    def associate(self, boxes):
+        pairs = [(boxIou(track.box, box), t, d) for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)]
+        pairs.sort(key=lambda pair: pair[0], reverse=True)
+        matchedTracks, matchedBoxes = set(), set()
+        for iou, t, d in pairs:
+            if iou < self.iouThreshold:
+                break
+            if t in matchedTracks or d in matchedBoxes:
+                continue
+            self.tracks[t].correct(boxes[d], self.frameIndex)
+            matchedTracks.add(t)
+            matchedBoxes.add(d)
+
+        # fast movers whose predicted box no longer overlaps enough are matched on the
+        # nearest centre within half a box width
+        for t, track in enumerate(self.tracks):
+            if t in matchedTracks:
+                continue
+            best, bestDistance = None, CENTROID_DISTANCE * track.box[2]
+            for d, box in enumerate(boxes):
+                if d in matchedBoxes:
+                    continue
+                distance = np.linalg.norm(boxCentre(box) - boxCentre(track.box))
+                if distance < bestDistance:
+                    best, bestDistance = d, distance
+            if best is not None:
+                track.correct(boxes[best], self.frameIndex)
+                matchedTracks.add(t)
+                matchedBoxes.add(best)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matchedTracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.maxMissed]
+        for d, box in enumerate(boxes):
+            if d not in matchedBoxes:
+                self.tracks.append(personTrack(self.nextId, box, self.frameIndex))
+                self.nextId += 1
+
+    def countCrossings(self):
+        if self.lineY is None:
+            return
+        for track in self.tracks:
+            side = boxCentre(track.box)[1] >= self.lineY
+            if track.side is None:
+                track.side = side
+            # unconfirmed tracks are mostly single-frame false detections and are not counted;
+            # they keep the side they were first seen on, so a person who crosses before being
+            # confirmed is counted when the track is
+            if side == track.side or track.hits < self.minHits:
+                continue
+            if side:
+                self.entered += 1
+            else:
+                self.exited += 1
+            track.side = side
+
+    def resetCounts(self):
+        self.entered = 0
+        self.exited = 0
+
+    def people(self):
+        return [(track.id, track.box.astype(int)) for track in self.tracks if track.hits >= self.minHits]
@@ -0,0 +1,138 @@
+from .stitch_images import stitch_images
+from . import instrumentation
+from . import utils
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+JOB_CONFIG_FILENAME = "job.json"
+
+
+def find_jobs(jobs_root):
+
+    # A job is any folder below jobs_root that directly contains image files.
+    jobs = []
+    for folder, dirnames, filenames in os.walk(jobs_root):
+        dirnames.sort()
+        image_filenames = sorted(f for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS))
+        if image_filenames:
+            jobs.append((folder, image_filenames))
+    return jobs
+
+
+def load_job_config(job_folder, defaults):
+
+    config = dict(defaults)
+    config_path = os.path.join(job_folder, JOB_CONFIG_FILENAME)
+    if os.path.isfile(config_path):
+        with open(config_path) as config_file:
+            config.update(json.load(config_file))
+    return config
+
+
+def run_job(job_folder, image_filenames, output_path, config):
+
+    record = {"job": job_folder, "output": output_path, "num_images": len(image_filenames),
+              "started": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    start = time.perf_counter()
+    recorder = instrumentation.StitchRecorder() if config.get("instrument") else None
+    try:
+        stitched_img = stitch_images(job_folder, image_filenames, config["stitch_direction"],
+                                     adaptive_ransac=config["adaptive_ransac"], mode=config["mode"],
+                                     recorder=recorder, registration_scale=config.get("registration_scale", 1),
+                                     refine=config.get("refine", False))
+        output_folder = os.path.dirname(output_path)
+        if output_folder and not os.path.isdir(output_folder):
+            os.makedirs(output_folder, exist_ok=True)
+        utils.save_image_atomic(output_path, stitched_img)
+        record["status"] = "ok"
+        record["output_shape"] = list(stitched_img.shape)
+    except Exception as err:
+        record["status"] = "failed"
+        record["error"] = type(err).__name__ + ": " + str(err)
+    if recorder is not None:
+        record["stages"] = recorder.summary()
+        record["slowest_pairs"] = recorder.slowest("pair", count=3)
+    record["seconds"] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def run_batch(jobs_root, output_root, stitch_direction=1, mode="global", adaptive_ransac=True, workers=None,
+              max_pending=None, log_path=None, output_ext=".jpg", instrument=False, registration_scale=1, refine=False):
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+    defaults = {"stitch_direction": stitch_direction, "mode": mode, "adaptive_ransac": adaptive_ransac,
+                "instrument": instrument, "registration_scale": registration_scale, "refine": refine}
+
+    log_file = open(log_path, "a") if log_path is not None else sys.stdout
+    records = []
+
+    def emit(record):
+        records.append(record)
+        log_file.write(json.dumps(record) + "\n")
+        log_file.flush()
+
+    # The worker processes live for the whole batch, so cv2 is imported once per
+    # worker instead of once per job. At most max_pending jobs are queued at a
+    # time; submission blocks until one of them finishes.
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for job_folder, image_filenames in find_jobs(jobs_root):
+                if len(pending) >= max_pending:
+                    done, pending = concurrent.futures.wait(pending,
+                                                            return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        emit(future.result())
+
+                rel_folder = os.path.relpath(job_folder, jobs_root)
+                if rel_folder == os.curdir:
+                    rel_folder = os.path.basename(os.path.abspath(jobs_root))
+                output_path = os.path.join(output_root, rel_folder + output_ext)
+                config = load_job_config(job_folder, defaults)
+                pending.add(executor.submit(run_job, job_folder, image_filenames, output_path, config))
+
+            for future in concurrent.futures.as_completed(pending):
+                emit(future.result())
+    finally:
+        if log_file is not sys.stdout:
+            log_file.close()
+    return records
+
+
+def main(argv=None):
+
+    arg_parse = argparse.ArgumentParser(description="Stitch every job folder below a root folder.")
+    arg_parse.add_argument("jobs_root", help="folder whose sub-folders each hold the images of one job")
+    arg_parse.add_argument("output_root", help="folder the stitched images are written to")
+    arg_parse.add_argument("-d", "--direction", type=int, default=1, help="0 for vertical, 1 for horizontal")
+    arg_parse.add_argument("-m", "--mode", default="global", help="'global' or 'incremental'")
+    arg_parse.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    arg_parse.add_argument("-q", "--queue-size", type=int, default=None, help="maximum number of queued jobs")
+    arg_parse.add_argument("-l", "--log", default=None, help="JSONL file the per-job records are appended to")
+    arg_parse.add_argument("-i", "--instrument", action="store_true",
+                           help="add per-stage timings and the slowest pairs to each job record")
+    arg_parse.add_argument("-s", "--registration-scale", type=int, default=1, choices=(1, 2, 4, 8),
+                           help="register on images decoded at 1/N size")
+    arg_parse.add_argument("-r", "--refine", action="store_true",
+                           help="refine each registration at full resolution (needs --registration-scale above 1)")
+    args = arg_parse.parse_args(argv)
+    if args.refine and args.registration_scale == 1:
+        arg_parse.error("--refine needs --registration-scale above 1")
+
+    records = run_batch(args.jobs_root, args.output_root, stitch_direction=args.direction, mode=args.mode,
+                        workers=args.workers, max_pending=args.queue_size, log_path=args.log,
+                        instrument=args.instrument, registration_scale=args.registration_scale, refine=args.refine)
+    failed = sum(1 for record in records if record["status"] != "ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+from . import exceptions
+from . import utils
+import argparse
+import json
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+
+DEFAULT_SIZES = ((640, 480), (1920, 1080))
+DEFAULT_OVERLAPS = (0.3, 0.5)
+DEFAULT_NOISE_LEVELS = (0.0, 4.0)
+PERSPECTIVE_JITTER = 0.02
+TIME_TOLERANCE = 0.25
+ERROR_TOLERANCE = 1.0
+ERROR_RELATIVE_TOLERANCE = 0.25
+
+
+def make_base_texture(height, width, seed=0):
+
+    # Smooth colour noise with random shapes on top, so ORB finds corners at
+    # every scale.
+    rng = np.random.default_rng(seed)
+    texture = (rng.random((max(1, height // 8), max(1, width // 8), 3)) * 255).astype(np.uint8)
+    texture = cv2.resize(texture, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(int(height * width / 4000)):
+        colour = tuple(int(c) for c in rng.integers(0, 255, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        if rng.random() < 0.5:
+            cv2.circle(texture, center, int(rng.integers(4, 40)), colour, -1)
+        else:
+            corner = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.rectangle(texture, center, corner, colour, 2)
+    return texture
+
+
+def make_synthetic_set(img_size, num_images=3, overlap=0.4, noise_std=0.0, stitch_direc=1, seed=0):
+
+    # Each image is a jittered perspective view of a window sliding over one
+    # base texture. true_h_mats[k] maps image k+1 onto image k, the same
+    # direction compute_homography_ransac estimates.
+    img_w, img_h = img_size
+    rng = np.random.default_rng(seed)
+    step = 1.0 - overlap
+    margin = int(0.1 * max(img_w, img_h))
+    if stitch_direc == 1:
+        base_w = int(img_w * (1 + step * (num_images - 1))) + 2 * margin
+        base_h = img_h + 2 * margin
+    else:
+        base_w = img_w + 2 * margin
+        base_h = int(img_h * (1 + step * (num_images - 1))) + 2 * margin
+    base = make_base_texture(base_h, base_w, seed)
+
+    corners = utils.get_corners_as_array(img_h, img_w).astype(np.float32)
+    view_h_mats = []
+    imgs = []
+    for k in range(num_images):
+        offset_x = margin + (k * step * img_w if stitch_direc == 1 else 0)
+        offset_y = margin + (k * step * img_h if stitch_direc == 0 else 0)
+        jitter = rng.uniform(-PERSPECTIVE_JITTER, PERSPECTIVE_JITTER, (4, 2)) * [img_w, img_h]
+        src_corners = (corners + [offset_x, offset_y] + jitter).astype(np.float32)
+        view_h_mat = cv2.getPerspectiveTransform(src_corners, corners)
+        img = cv2.warpPerspective(base, view_h_mat, (img_w, img_h))
+        if noise_std > 0:
+            noise = rng.normal(0.0, noise_std, img.shape)
+            img = np.clip(img.astype(np.float64) + noise, 0, 255).astype(np.uint8)
+        view_h_mats.append(view_h_mat)
+        imgs.append(img)
+
+    true_h_mats = []
+    for k in range(num_images - 1):
+        h_mat = np.matmul(view_h_mats[k], np.linalg.inv(view_h_mats[k + 1]))
+        true_h_mats.append(h_mat / h_mat[2, 2])
+    return imgs, true_h_mats
+
+
+def corner_error(h_mat, true_h_mat, img_shape):
+
+    corners = utils.get_corners_as_array(*img_shape[:2])
+    estimated = utils.transform_with_homography(h_mat, corners)
+    expected = utils.transform_with_homography(true_h_mat, corners)
+    return float(np.sqrt(np.sum(np.square(estimated - expected), axis=1)).mean())
+
+
+def time_call(func, *args, **kwargs):
+
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_pair(img_a, img_b, true_h_mat, stitch_direc, adaptive_ransac=False):
+
+    img_a_gray = cv2.cvtColor(img_a, cv2.COLOR_BGR2GRAY)
+    img_b_gray = cv2.cvtColor(img_b, cv2.COLOR_BGR2GRAY)
+    timings = {}
+    (matches_a, matches_b), timings["get_matches"] = time_call(utils.get_matches, img_a_gray, img_b_gray)
+    h_mat, timings["compute_homography_ransac"] = time_call(utils.compute_homography_ransac, matches_a, matches_b,
+                                                            adaptive=adaptive_ransac)
+    if stitch_direc == 0:
+        canvas_size = (img_a.shape[1], img_a.shape[0] + img_b.shape[0])
+    else:
+        canvas_size = (img_a.shape[1] + img_b.shape[1], img_a.shape[0])
+    canvas, timings["warpPerspective"] = time_call(cv2.warpPerspective, img_b, h_mat, canvas_size)
+    canvas[0:img_a.shape[0], 0:img_a.shape[1]] = img_a
+    _, timings["crop"] = time_call(utils.crop_to_valid_region, canvas)
+    return timings, corner_error(h_mat, true_h_mat, img_b.shape), matches_a.shape[0]
+
+
+def run_case(img_size, overlap, noise_std, repeat=3, num_images=3, stitch_direc=1, adaptive_ransac=False, seed=0):
+
+    # RANSAC samples from np.random, which is reseeded for every pair so each
+    # repeat, and each run of the same code, draws the same samples.
+    imgs, true_h_mats = make_synthetic_set(img_size, num_images, overlap, noise_std, stitch_direc, seed)
+    stage_times = {}
+    errors = []
+    num_matches = []
+    failures = 0
+    for _ in range(repeat):
+        for k in range(num_images - 1):
+            np.random.seed([seed, k])
+            try:
+                timings, error, matches = benchmark_pair(imgs[k], imgs[k + 1], true_h_mats[k], stitch_direc,
+                                                         adaptive_ransac)
+            except (exceptions.NotEnoughMatchPointsError, exceptions.MatchesNotConfident):
+                failures += 1
+                continue
+            for stage, seconds in timings.items():
+                stage_times.setdefault(stage, []).append(seconds)
+            errors.append(error)
+            num_matches.append(matches)
+
+    return {
+        "name": "%dx%d_overlap%.2f_noise%.1f" % (img_size[0], img_size[1], overlap, noise_std),
+        "img_size": list(img_size),
+        "overlap": overlap,
+        "noise_std": noise_std,
+        "pairs": repeat * (num_images - 1),
+        "failures": failures,
+        "median_seconds": {stage: float(np.median(times)) for stage, times in stage_times.items()},
+        "mean_corner_error": float(np.mean(errors)) if errors else None,
+        "median_corner_error": float(np.median(errors)) if errors else None,
+        "mean_matches": float(np.mean(num_matches)) if num_matches else 0.0,
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, overlaps=DEFAULT_OVERLAPS, noise_levels=DEFAULT_NOISE_LEVELS, repeat=3,
+                  adaptive_ransac=False, seed=0):
+
+    # One untimed pair first, so JIT compilation and lazy OpenCV setup do not
+    # land in the first case.
+    imgs, true_h_mats = make_synthetic_set(sizes[0], 2, overlaps[0], seed=seed)
+    benchmark_pair(imgs[0], imgs[1], true_h_mats[0], 1, adaptive_ransac)
+
+    cases = []
+    for img_size in sizes:
+        for overlap in overlaps:
+            for noise_std in noise_levels:
+                cases.append(run_case(img_size, overlap, noise_std, repeat=repeat, adaptive_ransac=adaptive_ransac,
+                                      seed=seed))
+    return {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+                        "machine": platform.machine()},
+        "adaptive_ransac": adaptive_ransac,
+        "cases": cases,
+    }
+
+
+def compare_to_baseline(results, baseline, time_tolerance=TIME_TOLERANCE, error_tolerance=ERROR_TOLERANCE,
+                        error_relative_tolerance=ERROR_RELATIVE_TOLERANCE):
+
+    # A stage regresses when its median time grows by more than time_tolerance
+    # (relative); accuracy regresses when the median corner error grows by more
+    # than error_relative_tolerance (relative) plus error_tolerance pixels, or
+    # a case starts failing more often.
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        base_case = baseline_cases.get(case["name"])
+        if base_case is None:
+            continue
+        for stage, seconds in case["median_seconds"].items():
+            base_seconds = base_case["median_seconds"].get(stage)
+            if base_seconds is not None and seconds > base_seconds * (1.0 + time_tolerance):
+                regressions.append("%s: %s took %.4fs, baseline %.4fs" % (case["name"], stage, seconds, base_seconds))
+        error, base_error = case["median_corner_error"], base_case.get("median_corner_error")
+        if error is not None and base_error is not None and \
+                error > base_error * (1.0 + error_relative_tolerance) + error_tolerance:
+            regressions.append("%s: corner error %.3fpx, baseline %.3fpx" % (case["name"], error, base_error))
+        if case["failures"] > base_case["failures"]:
+            regressions.append("%s: %d failed pairs, baseline %d" % (case["name"], case["failures"],
+                                                                     base_case["failures"]))
+    return regressions
+
+
+def parse_sizes(text):
+
+    return tuple(tuple(int(v) for v in size.lower().split("x")) for size in text.split(","))
+
+
+def main(argv=None):
+
+    arg_parse = argparse.ArgumentParser(description="Benchmark the imagestitch2 stages on synthetic image sets.")
+    arg_parse.add_argument("-o", "--output", default=None, help="JSON file the results are written to")
+    arg_parse.add_argument("-b", "--baseline", default=None, help="JSON results of an earlier run to compare with")
+    arg_parse.add_argument("-r", "--repeat", type=int, default=3, help="number of passes over each image set")
+    arg_parse.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES, help="e.g. 640x480,1920x1080")
+    arg_parse.add_argument("--overlaps", type=lambda t: tuple(float(v) for v in t.split(",")),
+                           default=DEFAULT_OVERLAPS, help="e.g. 0.3,0.5")
+    arg_parse.add_argument("--noise", type=lambda t: tuple(float(v) for v in t.split(",")),
+                           default=DEFAULT_NOISE_LEVELS, help="gaussian noise std devs, e.g. 0,4")
+    arg_parse.add_argument("--adaptive", action="store_true", help="use adaptive RANSAC")
+    arg_parse.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    args = arg_parse.parse_args(argv)
+
+    results = run_benchmark(args.sizes, args.overlaps, args.noise, repeat=args.repeat, adaptive_ransac=args.adaptive)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressions = compare_to_baseline(results, baseline, time_tolerance=args.time_tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+
+BLEND_MODES = ("feather", "multiband")
+MULTIBAND_MAX_LEVELS = 5
+EPSILON = 1e-6
+
+
+def get_feather_weights(src_mask, dst_mask):
+
+    # Weight of src grows with the distance from src's own border and shrinks
+    # with the distance from dst's border, so it falls off smoothly across the
+    # overlap. Only meaningful where both masks are set.
+    src_dis = cv2.distanceTransform(src_mask, cv2.DIST_L2, 3)
+    dst_dis = cv2.distanceTransform(dst_mask, cv2.DIST_L2, 3)
+    dst_dis += src_dis
+    dst_dis += EPSILON
+    np.divide(src_dis, dst_dis, out=src_dis)
+    return src_dis
+
+
+class MultiBandBlender(object):
+
+    # Pyramid buffers are kept between calls and only reallocated when the
+    # overlap shape or channel count changes.
+    def __init__(self, max_levels=MULTIBAND_MAX_LEVELS):
+        self.max_levels = max_levels
+        self._key = None
+        self._buffers = None
+
+    def get_buffers(self, shape):
+        height, width, channels = shape
+        num_levels = int(max(0, min(self.max_levels, np.floor(np.log2(max(1, min(height, width)))) - 1)))
+        key = (height, width, channels, num_levels)
+        if key != self._key:
+            sizes = [(height, width)]
+            for _ in range(num_levels):
+                sizes.append(((sizes[-1][0] + 1) // 2, (sizes[-1][1] + 1) // 2))
+            self._buffers = {
+                "src": [np.empty(size + (channels,), dtype=np.float32) for size in sizes],
+                "dst": [np.empty(size + (channels,), dtype=np.float32) for size in sizes],
+                "weight": [np.empty(size, dtype=np.float32) for size in sizes],
+                "up": [np.empty(size + (channels,), dtype=np.float32) for size in sizes[:-1]],
+            }
+            self._key = key
+        return self._buffers, num_levels
+
+    def blend(self, dst, dst_mask, src, src_mask, weights):
+        buffers, num_levels = self.get_buffers(dst.shape)
+        src_pyr, dst_pyr = buffers["src"], buffers["dst"]
+        weight_pyr, up_pyr = buffers["weight"], buffers["up"]
+
+        # Pixels missing from one image are filled from the other so that the
+        # low-pass levels do not pull in black borders.
+        src_pyr[0][...] = dst
+        np.copyto(src_pyr[0], src, where=src_mask[:, :, np.newaxis] > 0, casting="unsafe")
+        dst_pyr[0][...] = src_pyr[0]
+        np.copyto(dst_pyr[0], dst, where=dst_mask[:, :, np.newaxis] > 0, casting="unsafe")
+        np.greater_equal(weights, 0.5, out=weight_pyr[0], casting="unsafe")
+
+        for level in range(num_levels):
+            cv2.pyrDown(src_pyr[level], dst=src_pyr[level + 1])
+            cv2.pyrDown(dst_pyr[level], dst=dst_pyr[level + 1])
+            cv2.pyrDown(weight_pyr[level], dst=weight_pyr[level + 1])
+
+        # Laplacian levels in place, blended level by level.
+        for level in range(num_levels + 1):
+            if level < num_levels:
+                size = (src_pyr[level].shape[1], src_pyr[level].shape[0])
+                cv2.pyrUp(src_pyr[level + 1], dst=up_pyr[level], dstsize=size)
+                src_pyr[level] -= up_pyr[level]
+                cv2.pyrUp(dst_pyr[level + 1], dst=up_pyr[level], dstsize=size)
+                dst_pyr[level] -= up_pyr[level]
+            src_pyr[level] -= dst_pyr[level]
+            src_pyr[level] *= weight_pyr[level][:, :, np.newaxis]
+            src_pyr[level] += dst_pyr[level]
+
+        for level in range(num_levels - 1, -1, -1):
+            size = (src_pyr[level].shape[1], src_pyr[level].shape[0])
+            cv2.pyrUp(src_pyr[level + 1], dst=up_pyr[level], dstsize=size)
+            src_pyr[level] += up_pyr[level]
+        return src_pyr[0]
+
+
+def blend_overlap(dst, dst_mask, src, src_mask, mode="feather", blender=None):
+
+    # Blends src into dst in place where both masks are set. dst, src and the
+    # masks are same-sized views of the overlap region only.
+    if mode not in BLEND_MODES:
+        raise ValueError("blend mode must be one of " + ", ".join(BLEND_MODES) + " but got " + str(mode))
+    overlap = (src_mask > 0) & (dst_mask > 0)
+    if not overlap.any():
+        return dst
+
+    weights = get_feather_weights(src_mask, dst_mask)
+    if mode == "feather":
+        blended = dst.astype(np.float32)
+        blended -= src
+        blended *= (1.0 - weights)[:, :, np.newaxis]
+        blended += src
+    else:
+        if blender is None:
+            blender = MultiBandBlender()
+        blended = blender.blend(dst, dst_mask, src, src_mask, weights)
+
+    np.clip(blended, 0, 255, out=blended)
+    np.rint(blended, out=blended)
+    np.copyto(dst, blended, where=overlap[:, :, np.newaxis], casting="unsafe")
+    return dst
@@ -2,8 +2,12 @@ class InsufficientImagesError(Exception):
 
     def __init__(self, num_images):
         msg = "Expected 2 or more images but got only " +  str(num_images)
+        self.num_images = num_images
         super(InsufficientImagesError, self).__init__(msg)
 
+    def __reduce__(self):
+        return (InsufficientImagesError, (self.num_images,))
+
 
 class InvalidImageFilesError(Exception):
 
@@ -16,12 +20,21 @@ class NotEnoughMatchPointsError(Exception):
     def __init__(self, num_match_points, min_match_points_req):
         msg = "There are not enough match points between images in the input images. Required atleast " + \
                str(min_match_points_req) + " matches but could find only " + str(num_match_points) + " matches!"
+        self.num_match_points = num_match_points
+        self.min_match_points_req = min_match_points_req
         super(NotEnoughMatchPointsError, self).__init__(msg)
 
+    def __reduce__(self):
+        return (NotEnoughMatchPointsError, (self.num_match_points, self.min_match_points_req))
+
 
 class MatchesNotConfident(Exception):
 
     def __init__(self, confidence):
         msg = "The confidence in the matches is less than the defined threshold and hence the stitching operation \
         cannot be performed. Perhaps the input images have very less overlapping content to detect good match points!"
+        self.confidence = confidence
         super(MatchesNotConfident, self).__init__(msg + " Confidence: " + str(confidence))
+
+    def __reduce__(self):
+        return (MatchesNotConfident, (self.confidence,))
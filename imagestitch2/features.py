@@ -0,0 +1,186 @@
+import collections
+import itertools
+import os
+import cv2
+import numpy as np
+from . import instrumentation
+from . import loader
+from . import utils
+
+NUM_KEYPOINTS = 1000
+BAND_NONE = 0
+BAND_LEADING = 1
+BAND_TRAILING = 2
+
+# bands labels each point with the edge band it was detected in, or is None
+# when the whole image was searched.
+Features = collections.namedtuple("Features", ["points", "descriptors", "img_shape", "bands"])
+Features.__new__.__defaults__ = (None, None)
+
+
+class FeatureCache(object):
+
+    def __init__(self, key="mtime", max_entries=None):
+        if key not in ("mtime", "hash"):
+            raise ValueError("key must be 'mtime' or 'hash' but got " + str(key))
+        self.key = key
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def _cache_key(self, img_path, num_keypoints, overlap, scale=1):
+        full_path = os.path.abspath(img_path)
+        if self.key == "hash":
+            return utils.hash_file(full_path), num_keypoints, overlap, scale
+        return full_path, os.path.getmtime(full_path), num_keypoints, overlap, scale
+
+    def lookup(self, img_path, num_keypoints=1000, overlap=None, scale=1):
+        cache_key = self._cache_key(img_path, num_keypoints, overlap, scale)
+        if cache_key not in self._entries:
+            return None
+        self._entries.move_to_end(cache_key)
+        return self._entries[cache_key]
+
+    def store(self, img_path, features, num_keypoints=1000, overlap=None, scale=1):
+        self._entries[self._cache_key(img_path, num_keypoints, overlap, scale)] = features
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_features(self, img_path, img=None, num_keypoints=1000, overlap=None, recorder=None, scale=1):
+        features = self.lookup(img_path, num_keypoints, overlap, scale)
+        if features is None:
+            features = detect_image_features(img_path, img, num_keypoints, overlap, recorder, scale)
+            self.store(img_path, features, num_keypoints, overlap, scale)
+        return features
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def detect_image_features(img_path, img=None, num_keypoints=1000, overlap=None, recorder=None, scale=1):
+
+    # overlap is an optional (stitch_direc, fraction) pair; keypoints are then
+    # only detected in the bands along both edges that face a neighbour.
+    # With scale > 1, img is (or is decoded as) the image reduced by that
+    # factor; points and img_shape are still given at full resolution.
+    recorder = instrumentation.get_recorder(recorder)
+    if img is None:
+        with recorder.stage("decode"):
+            img = loader.read_image(img_path, scale)
+    with recorder.stage("gray"):
+        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    bands = None
+    with recorder.stage("detect"):
+        if overlap is None:
+            points, descriptors = utils.detect_features(img_gray, num_keypoints)
+        else:
+            points, descriptors, bands = detect_band_features(img_gray, num_keypoints, overlap)
+    recorder.set(num_keypoints=int(points.shape[0]))
+    if scale == 1:
+        return Features(points, descriptors, img_shape=img.shape, bands=bands)
+
+    # The header size is exact; it is only trusted if it reduces to the size
+    # that was actually decoded.
+    full_size = loader.read_image_size(img_path)
+    if full_size is None or tuple(-(-v // scale) for v in full_size) != img.shape[:2]:
+        full_size = (img.shape[0] * scale, img.shape[1] * scale)
+    return Features(loader.scale_points_to_full(points, scale), descriptors, img_shape=full_size + img.shape[2:],
+                    bands=bands)
+
+
+def detect_band_features(img_gray, num_keypoints, overlap):
+
+    # Each band is detected on its own crop of the image, with its share of
+    # num_keypoints, so ORB never runs over the middle of the image.
+    stitch_direc, fraction = overlap
+    band_keypoints = utils.get_band_keypoints(num_keypoints, fraction)
+    band_points, band_descriptors, bands = [], [], []
+    for band, side in ((BAND_LEADING, "b"), (BAND_TRAILING, "a")):
+        mask = utils.get_overlap_mask(img_gray.shape, stitch_direc, side, fraction)
+        points, descriptors = utils.detect_features(img_gray, band_keypoints, mask)
+        band_points.append(points)
+        band_descriptors.append(descriptors)
+        bands.append(np.full(points.shape[0], band, dtype=np.uint8))
+    return np.concatenate(band_points), np.concatenate(band_descriptors), np.concatenate(bands)
+
+
+def select_band(features, band):
+
+    # The features of one edge band; features of a whole image are all kept.
+    if features.bands is None:
+        return features
+    in_band = features.bands == band
+    return features._replace(points=features.points[in_band], descriptors=features.descriptors[in_band],
+                             bands=features.bands[in_band])
+
+
+def detect_scaled_features(img_path, img, num_keypoints=1000, overlap=None, recorder=None, scale=1):
+
+    # Like detect_image_features, for an image only held at full size (the
+    # incremental pivot): it is reduced here instead of at decode time.
+    if scale == 1:
+        return detect_image_features(img_path, img, num_keypoints, overlap, recorder)
+    img_small = cv2.resize(img, None, fx=1.0 / scale, fy=1.0 / scale, interpolation=cv2.INTER_AREA)
+    features = detect_image_features(img_path, img_small, num_keypoints, overlap, recorder, scale)
+    return features._replace(img_shape=img.shape)
+
+
+def get_features_for_paths(img_paths, feature_cache, num_keypoints=1000, executor=None, overlap=None,
+                           recorder=None, scale=1):
+
+    img_features = [feature_cache.lookup(img_path, num_keypoints, overlap, scale) for img_path in img_paths]
+    missing = [i for i, features in enumerate(img_features) if features is None]
+
+    # Stage timings are only recorded for in-process detection; worker
+    # processes cannot report into the recorder. In process, the next images
+    # are decoded on a thread pool while the current one is being detected.
+    recorder = instrumentation.get_recorder(recorder)
+    if executor is None:
+        computed = []
+        with loader.ImageLoader([img_paths[i] for i in missing], scale=scale) as img_loader:
+            for i, img_index in enumerate(missing):
+                recorder.begin("image", img=os.path.basename(img_paths[img_index]))
+                with recorder.stage("decode"):
+                    img = img_loader.get(i)
+                computed.append(detect_image_features(img_paths[img_index], img, num_keypoints, overlap, recorder,
+                                                      scale))
+    else:
+        # Workers decode the image themselves; only the point and descriptor
+        # arrays are sent back to this process.
+        computed = executor.map(detect_image_features, [img_paths[i] for i in missing],
+                                itertools.repeat(None), itertools.repeat(num_keypoints), itertools.repeat(overlap),
+                                itertools.repeat(None), itertools.repeat(scale))
+
+    for i, features in zip(missing, computed):
+        feature_cache.store(img_paths[i], features, num_keypoints, overlap, scale)
+        img_features[i] = features
+    return img_features
+
+
+def carry_features_forward(features_a, features_b, h_mat, img_a_shape, crop_box):
+
+    # Keypoints of the stitched result are rebuilt from the two inputs instead of
+    # re-running detection on the larger canvas: img_a keypoints keep their place,
+    # img_b keypoints are mapped through h_mat and only kept outside img_a's area.
+    img_a_h, img_a_w = img_a_shape[:2]
+    x_start, y_start, x_end, y_end = crop_box
+    offset = np.array([x_start, y_start])
+
+    points_b = utils.transform_with_homography(h_mat, features_b.points)
+    outside_a = (points_b[:, 0] >= img_a_w) | (points_b[:, 1] >= img_a_h)
+
+    points = np.concatenate((features_a.points, points_b[outside_a]), axis=0) - offset
+    descriptors = np.concatenate((features_a.descriptors, features_b.descriptors[outside_a]), axis=0)
+
+    inside_crop = (points[:, 0] >= 0) & (points[:, 1] >= 0) & \
+                  (points[:, 0] < x_end - x_start) & (points[:, 1] < y_end - y_start)
+    img_shape = (y_end - y_start, x_end - x_start) + tuple(img_a_shape[2:])
+
+    # Only img_b's trailing band is still an edge of the result.
+    bands = None
+    if features_b.bands is not None:
+        bands_b = np.where(features_b.bands[outside_a] == BAND_TRAILING, BAND_TRAILING, BAND_NONE).astype(np.uint8)
+        bands = np.concatenate((np.full(features_a.points.shape[0], BAND_NONE, dtype=np.uint8), bands_b))[inside_crop]
+    return Features(points[inside_crop], descriptors[inside_crop], img_shape, bands)
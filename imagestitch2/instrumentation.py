@@ -0,0 +1,92 @@
+import contextlib
+import json
+import time
+
+
+class NullRecorder(object):
+
+    # Stand-in used when instrumentation is off; every hook is a no-op so the
+    # stitching code can call it unconditionally.
+    enabled = False
+
+    def begin(self, kind, **fields):
+        pass
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def set(self, **fields):
+        pass
+
+    def track_arrays(self, *arrays):
+        pass
+
+
+NULL_STAGE = contextlib.nullcontext()
+NULL_RECORDER = NullRecorder()
+
+
+def get_recorder(recorder=None):
+
+    return NULL_RECORDER if recorder is None else recorder
+
+
+class StitchRecorder(object):
+
+    # Collects one record per image ("image"), registered pair ("pair") or
+    # render pass ("render"). Stage timings are wall-clock seconds and are
+    # added up if a stage runs more than once within a record.
+    enabled = True
+
+    def __init__(self):
+        self.records = []
+        self.peak_array_bytes = 0
+        self._current = None
+
+    def begin(self, kind, **fields):
+        self._current = {"kind": kind, "seconds": {}}
+        self._current.update(fields)
+        self.records.append(self._current)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._current is None:
+                self.begin("job")
+            seconds = self._current["seconds"]
+            seconds[name] = seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def set(self, **fields):
+        if self._current is None:
+            self.begin("job")
+        self._current.update(fields)
+
+    def track_arrays(self, *arrays):
+        # Bytes of the arrays that are alive together at this point; the largest
+        # such sum over the run is kept as peak_array_bytes.
+        array_bytes = sum(array.nbytes for array in arrays if array is not None)
+        self.set(array_bytes=max(array_bytes, self._current.get("array_bytes", 0)))
+        self.peak_array_bytes = max(self.peak_array_bytes, array_bytes)
+
+    def stage_totals(self):
+        totals = {}
+        for record in self.records:
+            for name, seconds in record["seconds"].items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def slowest(self, kind="pair", count=1):
+        records = [record for record in self.records if record["kind"] == kind]
+        return sorted(records, key=lambda record: sum(record["seconds"].values()), reverse=True)[:count]
+
+    def summary(self):
+        return {"stage_seconds": self.stage_totals(), "peak_array_bytes": self.peak_array_bytes,
+                "num_records": len(self.records)}
+
+    def write_jsonl(self, path):
+        with open(path, "a") as log_file:
+            for record in self.records:
+                log_file.write(json.dumps(record) + "\n")
@@ -0,0 +1,156 @@
+from . import exceptions
+from . import utils
+import concurrent.futures
+import struct
+import cv2
+
+PREFETCH_DEPTH = 2
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_APP1_MARKER = 0xE1
+EXIF_ORIENTATION_TAG = 0x0112
+# Orientations that rotate by 90 degrees, swapping width and height.
+EXIF_TRANSPOSED_ORIENTATIONS = frozenset((5, 6, 7, 8))
+
+
+def read_image(img_path, scale=1):
+
+    # scale > 1 decodes straight to a reduced size; libjpeg then skips most of
+    # the IDCT work instead of decoding at full size and resizing.
+    if scale not in REDUCED_READ_FLAGS:
+        raise ValueError("scale must be one of " + ", ".join(map(str, sorted(REDUCED_READ_FLAGS))) + " but got " +
+                         str(scale))
+    img = cv2.imread(img_path, REDUCED_READ_FLAGS[scale])
+    if img is None:
+        raise exceptions.InvalidImageFilesError("Could not decode image file: " + img_path)
+    return img
+
+
+def get_exif_orientation(exif_data):
+
+    # Orientation tag of IFD0 in the payload of a JPEG APP1 Exif segment, or 1
+    # (upright) if it is missing or cannot be parsed.
+    tiff = exif_data[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return 1
+    byte_order = "<" if tiff[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(byte_order + "I", tiff[4:8])[0]
+    if ifd_offset + 2 > len(tiff):
+        return 1
+    num_entries = struct.unpack(byte_order + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+    for entry in range(num_entries):
+        start = ifd_offset + 2 + 12 * entry
+        if start + 10 > len(tiff):
+            break
+        tag, _, _, value = struct.unpack(byte_order + "HHIH", tiff[start:start + 10])
+        if tag == EXIF_ORIENTATION_TAG:
+            return value
+    return 1
+
+
+def read_image_size(img_path):
+
+    # Full-resolution (height, width) from the PNG IHDR chunk or the JPEG SOF
+    # segment, without decoding any pixels. Returns None if not found. As
+    # cv2.imread applies the Exif orientation of JPEGs, width and height are
+    # swapped for the orientations that rotate by 90 degrees.
+    img_format = utils.sniff_image_format(img_path)
+    with open(img_path, "rb") as img_file:
+        if img_format == "png":
+            img_file.seek(16)
+            width, height = struct.unpack(">II", img_file.read(8))
+            return height, width
+        if img_format != "jpeg":
+            return None
+        img_file.seek(2)
+        orientation = 1
+        while True:
+            marker = img_file.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if marker[1] == 0xFF:
+                img_file.seek(-1, 1)
+                continue
+            segment_length = struct.unpack(">H", img_file.read(2))[0]
+            if marker[1] == JPEG_APP1_MARKER:
+                segment = img_file.read(segment_length - 2)
+                if segment.startswith(b"Exif\0\0"):
+                    orientation = get_exif_orientation(segment)
+                continue
+            if marker[1] in JPEG_SOF_MARKERS:
+                _, height, width = struct.unpack(">BHH", img_file.read(5))
+                if orientation in EXIF_TRANSPOSED_ORIENTATIONS:
+                    return width, height
+                return height, width
+            img_file.seek(segment_length - 2, 1)
+
+
+def scale_points_to_full(points, scale):
+
+    # Pixel centres of a reduced image map back to (x + 0.5) * scale - 0.5.
+    if scale == 1:
+        return points
+    return (points + 0.5) * scale - 0.5
+
+
+class ImageLoader(object):
+
+    # Decodes img_paths on a thread pool, keeping up to prefetch images ahead of
+    # the one last requested, in whichever direction the indices are walked.
+    # cv2.imread releases the GIL, so decoding overlaps with the matching and
+    # warping done by the caller.
+    def __init__(self, img_paths, scale=1, prefetch=PREFETCH_DEPTH):
+        self.img_paths = list(img_paths)
+        self.scale = scale
+        self.prefetch = max(0, prefetch)
+        self._executor = None
+        self._futures = {}
+        self._last_index = None
+        if self.prefetch > 0:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch)
+
+    def _submit(self, index):
+        if 0 <= index < len(self.img_paths) and index not in self._futures:
+            self._futures[index] = self._executor.submit(read_image, self.img_paths[index], self.scale)
+
+    def get(self, index):
+        if self._executor is None:
+            return read_image(self.img_paths[index], self.scale)
+        step = -1 if self._last_index is not None and index < self._last_index else 1
+        self._last_index = index
+        for ahead in range(self.prefetch + 1):
+            self._submit(index + step * ahead)
+        return self._futures.pop(index).result()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.img_paths)
+        if not 0 <= index < len(self.img_paths):
+            raise IndexError("image index out of range")
+        return self.get(index)
+
+    def __len__(self):
+        return len(self.img_paths)
+
+    def __iter__(self):
+        for index in range(len(self.img_paths)):
+            yield self.get(index)
+
+    def close(self):
+        if self._executor is not None:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
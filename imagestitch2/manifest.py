@@ -0,0 +1,82 @@
+import json
+import os
+import numpy as np
+from . import matchers
+
+MANIFEST_VERSION = 1
+
+
+def get_settings(stitch_direction, adaptive_ransac=False, overlap_fraction=None, matcher=None, registration_scale=1,
+                 refine=False):
+
+    # Everything besides the image contents that changes the homographies. A
+    # manifest written with other settings is not reused. refine is only
+    # stored when set, so manifests written before it existed stay valid.
+    if matcher is not None and not isinstance(matcher, str):
+        names = [name for name, matcher_class in matchers.MATCHERS.items() if type(matcher) is matcher_class]
+        matcher = names[0] if names else type(matcher).__name__
+    settings = {"stitch_direction": stitch_direction, "adaptive_ransac": bool(adaptive_ransac),
+                "overlap_fraction": overlap_fraction, "matcher": matcher, "registration_scale": registration_scale}
+    if refine:
+        settings["refine"] = True
+    return settings
+
+
+def build_manifest(image_filenames, img_hashes, img_shapes, pair_h_mats, confidences, settings):
+
+    # One entry per image: its homography into the first image's frame, plus
+    # the homography onto the previous image and that pair's confidence, which
+    # is what a later run reuses.
+    h_mat = np.eye(3)
+    images = []
+    for i, filename in enumerate(image_filenames):
+        entry = {"filename": filename, "hash": img_hashes[i], "size": [int(v) for v in img_shapes[i]]}
+        if i > 0:
+            h_mat = np.matmul(h_mat, pair_h_mats[i - 1])
+            h_mat = h_mat / h_mat[2, 2]
+            entry["pair_h_mat"] = np.asarray(pair_h_mats[i - 1]).tolist()
+            entry["confidence"] = float(confidences[i - 1])
+        entry["h_mat"] = h_mat.tolist()
+        images.append(entry)
+    return {"version": MANIFEST_VERSION, "settings": settings, "images": images}
+
+
+def load_manifest(manifest_path):
+
+    if not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest_path, manifest):
+
+    tmp_path = manifest_path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, manifest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_cached_registration(manifest, settings):
+
+    # Pairs are looked up by the content hashes of both images, so renamed,
+    # reordered or unchanged images keep their registration and only pairs
+    # touching a changed image are registered again.
+    if manifest is None or manifest["settings"] != json.loads(json.dumps(settings)):
+        return {}, {}
+    pairs = {}
+    img_shapes = {}
+    prev_hash = None
+    for entry in manifest["images"]:
+        img_shapes[entry["hash"]] = tuple(entry["size"])
+        if prev_hash is not None:
+            pairs[(prev_hash, entry["hash"])] = (np.array(entry["pair_h_mat"]), entry["confidence"])
+        prev_hash = entry["hash"]
+    return pairs, img_shapes
@@ -0,0 +1,133 @@
+import itertools
+import cv2
+import numpy as np
+
+FLANN_INDEX_LSH = 6
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+NUMPY_MATCHER_CHUNK_SIZE = 256
+LSH_RECHECK_RATIO = 0.8
+
+
+def get_knn_dtype(k):
+
+    return np.dtype([("train_idx", np.int32, (k,)), ("distance", np.float32, (k,))])
+
+
+def empty_knn_matches(num_queries, k):
+
+    # One row per query descriptor; missing neighbours have train_idx -1.
+    knn_matches = np.empty(num_queries, dtype=get_knn_dtype(k))
+    knn_matches["train_idx"] = -1
+    knn_matches["distance"] = np.inf
+    return knn_matches
+
+
+def knn_matches_to_array(matches_list, k):
+
+    knn_matches = empty_knn_matches(len(matches_list), k)
+    lengths = np.fromiter(map(len, matches_list), dtype=np.int64, count=len(matches_list))
+    flat_matches = list(itertools.chain.from_iterable(matches_list))
+    if not flat_matches:
+        return knn_matches
+
+    rows = np.repeat(np.arange(len(matches_list)), lengths)
+    cols = np.arange(len(flat_matches)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    knn_matches["train_idx"][rows, cols] = [match.trainIdx for match in flat_matches]
+    knn_matches["distance"][rows, cols] = [match.distance for match in flat_matches]
+    return knn_matches
+
+
+class BruteForceMatcher(object):
+
+    def knn_match(self, desc_a, desc_b, k=2, mask=None):
+        dis_matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        if mask is None:
+            return knn_matches_to_array(dis_matcher.knnMatch(desc_a, desc_b, k=k), k)
+        return knn_matches_to_array(dis_matcher.knnMatch(desc_a, desc_b, k=k, mask=mask), k)
+
+
+class FlannLshMatcher(object):
+
+    def __init__(self, table_number=6, key_size=12, multi_probe_level=1, checks=50, recheck_ratio=LSH_RECHECK_RATIO):
+        self.index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=table_number, key_size=key_size,
+                                 multi_probe_level=multi_probe_level)
+        self.search_params = dict(checks=checks)
+        self.recheck_ratio = recheck_ratio
+
+    def knn_match(self, desc_a, desc_b, k=2, mask=None):
+        # FLANN has no per-pair mask support; masked searches use brute force.
+        if mask is not None:
+            return BruteForceMatcher().knn_match(desc_a, desc_b, k=k, mask=mask)
+        dis_matcher = cv2.FlannBasedMatcher(self.index_params, self.search_params)
+        knn_matches = knn_matches_to_array(dis_matcher.knnMatch(desc_a, desc_b, k=k), k)
+        if self.recheck_ratio is None or k < 2:
+            return knn_matches
+
+        # LSH often misses the true second neighbour, and the too-large second
+        # distance lets ambiguous matches through the ratio test. Rows that
+        # could pass it are searched again exactly, which is cheap as they are
+        # usually a small part of desc_a.
+        distances = knn_matches["distance"]
+        recheck = (knn_matches["train_idx"][:, 0] >= 0) & ~(distances[:, 0] >= self.recheck_ratio * distances[:, 1])
+        rows = np.flatnonzero(recheck)
+        if rows.size > 0:
+            knn_matches[rows] = BruteForceMatcher().knn_match(desc_a[rows], desc_b, k=k)
+        return knn_matches
+
+
+class NumpyHammingMatcher(object):
+
+    def __init__(self, chunk_size=NUMPY_MATCHER_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def hamming_distances(self, desc_a, desc_b):
+        # XOR of the packed descriptor bytes, then a per-byte popcount (lookup
+        # table on NumPy versions without np.bitwise_count).
+        distances = np.empty((desc_a.shape[0], desc_b.shape[0]), dtype=np.uint16)
+        for start in range(0, desc_a.shape[0], self.chunk_size):
+            xor = np.bitwise_xor(desc_a[start:start + self.chunk_size, np.newaxis, :], desc_b[np.newaxis, :, :])
+            if hasattr(np, "bitwise_count"):
+                bit_counts = np.bitwise_count(xor)
+            else:
+                bit_counts = POPCOUNT_TABLE[xor]
+            distances[start:start + self.chunk_size] = bit_counts.sum(axis=2, dtype=np.uint16)
+        return distances
+
+    def knn_match(self, desc_a, desc_b, k=2, mask=None):
+        distances = self.hamming_distances(desc_a, desc_b).astype(np.float32)
+        if mask is not None:
+            distances[mask == 0] = np.inf
+
+        num_neighbours = min(k, desc_b.shape[0])
+        if num_neighbours < desc_b.shape[0]:
+            nearest = np.argpartition(distances, num_neighbours - 1, axis=1)[:, :num_neighbours]
+        else:
+            nearest = np.arange(desc_b.shape[0])[np.newaxis, :].repeat(desc_a.shape[0], axis=0)
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1, kind="stable")
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+
+        knn_matches = empty_knn_matches(desc_a.shape[0], k)
+        found = np.isfinite(nearest_distances)
+        knn_matches["train_idx"][:, :num_neighbours] = np.where(found, nearest, -1)
+        knn_matches["distance"][:, :num_neighbours] = nearest_distances
+        return knn_matches
+
+
+MATCHERS = {
+    "bf": BruteForceMatcher,
+    "flann": FlannLshMatcher,
+    "numpy": NumpyHammingMatcher,
+}
+
+
+def get_matcher(matcher=None):
+
+    if matcher is None:
+        return BruteForceMatcher()
+    if isinstance(matcher, str):
+        if matcher not in MATCHERS:
+            raise ValueError("Unknown matcher " + matcher + ", expected one of " + ", ".join(sorted(MATCHERS)))
+        return MATCHERS[matcher]()
+    return matcher
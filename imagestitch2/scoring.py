@@ -0,0 +1,82 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+EPSILON = 1e-7
+
+
+class ScoringBuffers(object):
+
+    # Homogeneous match coordinates and scratch space for scoring up to
+    # max_hypotheses homographies at once, allocated once per RANSAC run.
+    def __init__(self, points_img_a, points_img_b, max_hypotheses, dtype=np.float64):
+        num_points = points_img_a.shape[0]
+        self.max_hypotheses = max_hypotheses
+        self.points_a_t = np.ascontiguousarray(points_img_a.T, dtype=dtype)
+        self.points_b_h = np.ones((3, num_points), dtype=dtype)
+        self.points_b_h[0:2, :] = points_img_b.T
+        self.projected = np.empty((max_hypotheses, 3, num_points), dtype=dtype)
+        self.sq_dis = np.empty((max_hypotheses, num_points), dtype=dtype)
+        self.scratch = np.empty((max_hypotheses, num_points), dtype=dtype)
+        self.inliers = np.empty((max_hypotheses, num_points), dtype=bool)
+
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def count_inliers_kernel(h_mats, points_a_t, points_b_h, threshold_sq, counts):
+        for i in range(h_mats.shape[0]):
+            h = h_mats[i]
+            count = 0
+            for j in range(points_b_h.shape[1]):
+                x = points_b_h[0, j]
+                y = points_b_h[1, j]
+                w = h[2, 0] * x + h[2, 1] * y + h[2, 2] + EPSILON
+                d_x = (h[0, 0] * x + h[0, 1] * y + h[0, 2]) / w - points_a_t[0, j]
+                d_y = (h[1, 0] * x + h[1, 1] * y + h[1, 2]) / w - points_a_t[1, j]
+                if d_x * d_x + d_y * d_y <= threshold_sq:
+                    count += 1
+            counts[i] = count
+
+else:
+    count_inliers_kernel = None
+
+
+def score_homographies(h_mats, buffers, threshold=3, return_masks=False):
+
+    # Squared reprojection distances are compared against threshold**2, so no
+    # sqrt is taken. Masks are views into buffers and are overwritten by the
+    # next call.
+    num_hypotheses = h_mats.shape[0]
+    threshold_sq = float(threshold) ** 2
+    h_mats = h_mats.astype(buffers.points_b_h.dtype, copy=False)
+
+    if count_inliers_kernel is not None and not return_masks:
+        counts = np.empty(num_hypotheses, dtype=np.int64)
+        count_inliers_kernel(h_mats, buffers.points_a_t, buffers.points_b_h, threshold_sq, counts)
+        return counts
+
+    projected = buffers.projected[:num_hypotheses]
+    sq_dis = buffers.sq_dis[:num_hypotheses]
+    scratch = buffers.scratch[:num_hypotheses]
+    inliers = buffers.inliers[:num_hypotheses]
+
+    np.matmul(h_mats, buffers.points_b_h, out=projected)
+    w = projected[:, 2, :]
+    np.add(w, EPSILON, out=w)
+
+    np.divide(projected[:, 0, :], w, out=scratch)
+    np.subtract(scratch, buffers.points_a_t[0], out=scratch)
+    np.multiply(scratch, scratch, out=sq_dis)
+    np.divide(projected[:, 1, :], w, out=scratch)
+    np.subtract(scratch, buffers.points_a_t[1], out=scratch)
+    np.multiply(scratch, scratch, out=scratch)
+    np.add(sq_dis, scratch, out=sq_dis)
+
+    np.less_equal(sq_dis, threshold_sq, out=inliers)
+    if return_masks:
+        return inliers
+    return np.count_nonzero(inliers, axis=1)
@@ -1,10 +1,20 @@
 from . import utils
 from . import exceptions
+from . import features
+from . import tiled
+from . import blending
+from . import instrumentation
+from . import loader
+from . import manifest
+import concurrent.futures
 import os
 import cv2
+import numpy as np
 import time
 
-def stitch_images(image_folder, image_filenames, stitch_direction):
+REGISTRATION_ERRORS = (exceptions.NotEnoughMatchPointsError, exceptions.MatchesNotConfident)
+
+def check_inputs(image_folder, image_filenames):
 
     num_images = len(image_filenames)
     
@@ -14,26 +24,465 @@ def stitch_images(image_folder, image_filenames, stitch_direction):
     valid_files, file_error_msg = utils.check_imgfile_validity(image_folder, image_filenames)
     if not valid_files:
         raise(exceptions.InvalidImageFilesError(file_error_msg))
+
+def create_executor(workers):
+
+    if workers is None or workers <= 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+def register_image_pair(features_a, features_b, adaptive_ransac=False, matcher=None, recorder=None,
+                        registration_scale=1):
+
+    # Features detected at registration_scale are only that precise once
+    # mapped to full resolution, so the inlier threshold grows with the scale.
+    # With edge bands, img_a's trailing band is matched to img_b's leading one.
+    recorder = instrumentation.get_recorder(recorder)
+    threshold = utils.RANSAC_INLIER_THRESHOLD * registration_scale
+    features_a = features.select_band(features_a, features.BAND_TRAILING)
+    features_b = features.select_band(features_b, features.BAND_LEADING)
+    with recorder.stage("match"):
+        matches_a, matches_b = utils.match_features(features_a.points, features_a.descriptors,
+                                                    features_b.points, features_b.descriptors, matcher=matcher)
+    inliers_mask = None
+    with recorder.stage("ransac"):
+        if adaptive_ransac:
+            h_mat, inliers_mask, num_iterations = utils.compute_homography_ransac_adaptive(matches_a, matches_b,
+                                                                                           threshold=threshold)
+        else:
+            h_mat = utils.compute_homography_ransac(matches_a, matches_b, threshold=threshold)
+            num_iterations = utils.fixed_ransac_iterations()
+
+    # The inlier ratio is returned as the confidence of the registration.
+    if inliers_mask is None:
+        inliers_mask = utils.compute_inliers_mask(h_mat, matches_a, matches_b, threshold)
+    inlier_ratio = float(np.count_nonzero(inliers_mask)) / max(1, matches_a.shape[0])
+    recorder.set(num_matches=int(matches_a.shape[0]), ransac_iterations=int(num_iterations), inlier_ratio=inlier_ratio)
+    return h_mat, inlier_ratio
+
+def get_overlap(stitch_direction, overlap_fraction):
+
+    if overlap_fraction is None:
+        return None
+    return stitch_direction, overlap_fraction
+
+def widen_overlap(overlap):
+
+    # Next band to try after a failed registration, widened as in
+    # utils.get_matches_in_overlap; None (the full images) comes last.
+    stitch_direction, overlap_fraction = overlap
+    overlap_fraction = overlap_fraction * utils.OVERLAP_WIDEN_FACTOR
+    if overlap_fraction >= 1.0:
+        return None
+    return stitch_direction, overlap_fraction
+
+def register_image_pair_widening(get_pair_features, overlap, adaptive_ransac=False, matcher=None, recorder=None,
+                                 registration_scale=1):
+
+    # get_pair_features(overlap) returns the features of both images for a band
+    # (or for the full images when overlap is None). The band is widened after
+    # every failed registration until the full images are used. Returns the
+    # homography, its confidence and the two features that produced it.
+    recorder = instrumentation.get_recorder(recorder)
+    while True:
+        features_a, features_b = get_pair_features(overlap)
+        try:
+            h_mat, confidence = register_image_pair(features_a, features_b, adaptive_ransac=adaptive_ransac,
+                                                    matcher=matcher, recorder=recorder,
+                                                    registration_scale=registration_scale)
+            return h_mat, confidence, features_a, features_b
+        except REGISTRATION_ERRORS:
+            if overlap is None:
+                raise
+            overlap = widen_overlap(overlap)
+            recorder.set(overlap_fallback=True, overlap_fraction=None if overlap is None else overlap[1])
+
+def register_image_pairs(img_paths, img_features, feature_cache, adaptive_ransac=False, overlap=None, executor=None,
+                         matcher=None, recorder=None, registration_scale=1, pair_indices=None):
+
+    # Registers the pairs (i, i + 1) for i in pair_indices (all adjacent pairs
+    # by default) and returns their homographies and confidences.
+    if pair_indices is None:
+        pair_indices = range(len(img_paths) - 1)
+    pair_features = [(i, img_features[i], img_features[i + 1]) for i in pair_indices]
+    if executor is not None:
+        futures = [executor.submit(register_image_pair, features_a, features_b, adaptive_ransac, matcher, None,
+                                   registration_scale)
+                   for _, features_a, features_b in pair_features]
+
+    recorder = instrumentation.get_recorder(recorder)
+    pair_h_mats = []
+    confidences = []
+    for j, (i, features_a, features_b) in enumerate(pair_features):
+        recorder.begin("pair", index=i, img_a=os.path.basename(img_paths[i]),
+                       img_b=os.path.basename(img_paths[i + 1]))
+        try:
+            if executor is not None:
+                with recorder.stage("wait"):
+                    h_mat, confidence = futures[j].result()
+            else:
+                h_mat, confidence = register_image_pair(features_a, features_b, adaptive_ransac=adaptive_ransac,
+                                                        matcher=matcher, recorder=recorder,
+                                                        registration_scale=registration_scale)
+        except REGISTRATION_ERRORS:
+            if overlap is None:
+                raise
+            # The edge bands were too narrow for this pair, so they are widened
+            # step by step, ending with features of the whole images.
+            def get_pair_features(pair_overlap, i=i):
+                return (feature_cache.get_features(img_paths[i], overlap=pair_overlap, scale=registration_scale),
+                        feature_cache.get_features(img_paths[i + 1], overlap=pair_overlap, scale=registration_scale))
+            recorder.set(overlap_fallback=True)
+            h_mat, confidence, _, _ = register_image_pair_widening(get_pair_features, widen_overlap(overlap),
+                                                                   adaptive_ransac=adaptive_ransac, matcher=matcher,
+                                                                   recorder=recorder,
+                                                                   registration_scale=registration_scale)
+        pair_h_mats.append(h_mat)
+        confidences.append(confidence)
+    return pair_h_mats, confidences
+
+def refine_image_pair(img_a, img_b, h_mat, adaptive_ransac=False, matcher=None, recorder=None,
+                      registration_scale=1):
+
+    # Fine stage for a homography registered on reduced images: keypoints are
+    # detected at full resolution only where h_mat predicts the overlap, and
+    # only matched within a few pixels of their predicted position. The
+    # coarse homography is kept when that does not register the pair.
+    recorder = instrumentation.get_recorder(recorder)
+    window_radius = max(utils.PYRAMID_WINDOW_RADIUS, 2 * registration_scale)
+    with recorder.stage("refine"):
+        img_a_gray = cv2.cvtColor(img_a, cv2.COLOR_BGR2GRAY)
+        img_b_gray = cv2.cvtColor(img_b, cv2.COLOR_BGR2GRAY)
+        try:
+            matches_a, matches_b = utils.get_matches_refined(img_a_gray, img_b_gray, h_mat,
+                                                             window_radius=window_radius, matcher=matcher)
+            if adaptive_ransac:
+                h_mat, _, _ = utils.compute_homography_ransac_adaptive(matches_a, matches_b)
+            else:
+                h_mat = utils.compute_homography_ransac(matches_a, matches_b)
+        except REGISTRATION_ERRORS:
+            recorder.set(refined=False)
+            return h_mat
+    recorder.set(refined=True, num_refined_matches=int(matches_a.shape[0]))
+    return h_mat
+
+def refine_image_pairs(img_paths, pair_indices, pair_h_mats, adaptive_ransac=False, matcher=None, recorder=None,
+                       registration_scale=1):
+
+    # Pairs are refined in order, so an image shared by two consecutive pairs
+    # is decoded only once.
+    recorder = instrumentation.get_recorder(recorder)
+    decoded = {}
+    refined_h_mats = []
+    for i, h_mat in zip(pair_indices, pair_h_mats):
+        recorder.begin("refine", index=i, img_a=os.path.basename(img_paths[i]),
+                       img_b=os.path.basename(img_paths[i + 1]))
+        with recorder.stage("decode"):
+            decoded = {j: decoded[j] if j in decoded else loader.read_image(img_paths[j]) for j in (i, i + 1)}
+        refined_h_mats.append(refine_image_pair(decoded[i], decoded[i + 1], h_mat, adaptive_ransac=adaptive_ransac,
+                                                matcher=matcher, recorder=recorder,
+                                                registration_scale=registration_scale))
+    return refined_h_mats
+
+def stitch_images(image_folder, image_filenames, stitch_direction, adaptive_ransac=False, feature_cache=None,
+                  mode="incremental", workers=None, overlap_fraction=None, matcher=None, blend=None, recorder=None,
+                  registration_scale=1, manifest_path=None, refine=False):
+
+    # recorder is an optional instrumentation.StitchRecorder that collects
+    # per-image and per-pair stage timings and counters. registration_scale
+    # (2, 4 or 8) detects features on images decoded at reduced size; the
+    # incremental mode still decodes every image at full size for compositing.
+    # refine then refines every pair's homography at full resolution, with
+    # matches restricted to the overlap and windows the coarse one predicts.
+    # manifest_path (global mode only) names a JSON
+    # registration manifest that is reused and updated, so re-renders only
+    # register pairs whose images changed.
+    if mode == "global":
+        return stitch_images_global(image_folder, image_filenames, stitch_direction,
+                                    adaptive_ransac=adaptive_ransac, feature_cache=feature_cache, workers=workers,
+                                    overlap_fraction=overlap_fraction, matcher=matcher, blend=blend,
+                                    recorder=recorder, registration_scale=registration_scale,
+                                    manifest_path=manifest_path, refine=refine)
+    if mode != "incremental":
+        raise ValueError("mode must be 'incremental' or 'global' but got " + str(mode))
+    if manifest_path is not None:
+        raise ValueError("manifest_path is only supported in the global mode")
+
+    check_inputs(image_folder, image_filenames)
+    check_refine(refine, registration_scale)
+
+    if feature_cache is None:
+        feature_cache = features.FeatureCache()
+    overlap = get_overlap(stitch_direction, overlap_fraction)
+
+    # Features of the original images are independent of the growing pivot, so
+    # with workers they are all extracted in parallel before the serial loop.
+    executor = create_executor(workers)
+    if executor is not None:
+        with executor:
+            img_paths = [os.path.join(image_folder, filename) for filename in image_filenames]
+            features.get_features_for_paths(img_paths, feature_cache, executor=executor, overlap=overlap,
+                                            scale=registration_scale)
     
-    pivot_img_path = os.path.join(image_folder, image_filenames[0])
-    pivot_img = cv2.imread(pivot_img_path)
+    # The next images are decoded on a thread pool while the current pair is
+    # being registered and composited. With registration_scale, a second
+    # loader prefetches the reduced decodes that features are detected on.
+    recorder = instrumentation.get_recorder(recorder)
+    blender = blending.MultiBandBlender() if blend == "multiband" else None
+    img_paths = [os.path.join(image_folder, filename) for filename in image_filenames]
+    reduced_loader = loader.ImageLoader(img_paths, scale=registration_scale) if registration_scale != 1 else None
+    with loader.ImageLoader(img_paths) as img_loader:
+        try:
+            return stitch_images_incremental(img_loader, image_filenames, stitch_direction, adaptive_ransac,
+                                             feature_cache, overlap, matcher, blend, blender, recorder,
+                                             reduced_loader, refine)
+        finally:
+            if reduced_loader is not None:
+                reduced_loader.close()
+
+def check_refine(refine, registration_scale):
+
+    if refine and registration_scale == 1:
+        raise ValueError("refine needs a registration_scale above 1")
+
+def get_loaded_features(feature_cache, img_loader, reduced_loader, index, img, overlap, recorder):
+
+    img_path = img_loader.img_paths[index]
+    if reduced_loader is None:
+        return feature_cache.get_features(img_path, img, overlap=overlap, recorder=recorder)
+    # The reduced image is only decoded on a cache miss.
+    img_features = feature_cache.lookup(img_path, overlap=overlap, scale=reduced_loader.scale)
+    if img_features is None:
+        with recorder.stage("decode"):
+            img_small = reduced_loader.get(index)
+        img_features = feature_cache.get_features(img_path, img_small, overlap=overlap, recorder=recorder,
+                                                  scale=reduced_loader.scale)
+    return img_features
+
+def stitch_images_incremental(img_loader, image_filenames, stitch_direction, adaptive_ransac, feature_cache, overlap,
+                              matcher, blend, blender, recorder, reduced_loader=None, refine=False):
+
+    num_images = len(image_filenames)
+    registration_scale = 1 if reduced_loader is None else reduced_loader.scale
+    pivot_img_path = img_loader.img_paths[0]
+    recorder.begin("image", img=image_filenames[0])
+    with recorder.stage("decode"):
+        pivot_img = img_loader.get(0)
+    pivot_features = get_loaded_features(feature_cache, img_loader, reduced_loader, 0, pivot_img, overlap, recorder)
 
     for i in range(1, num_images, 1):
-        join_img_path = os.path.join(image_folder, image_filenames[i])
-        join_img = cv2.imread(join_img_path)
-        pivot_img = utils.stitch_image_pair(pivot_img, join_img, stitch_direc=stitch_direction)
+        recorder.begin("pair", index=i - 1, img_a=image_filenames[i - 1], img_b=image_filenames[i])
+        join_img_path = img_loader.img_paths[i]
+        with recorder.stage("decode"):
+            join_img = img_loader.get(i)
+        join_features = get_loaded_features(feature_cache, img_loader, reduced_loader, i, join_img, overlap,
+                                            recorder)
+
+        try:
+            h_mat, _ = register_image_pair(pivot_features, join_features, adaptive_ransac=adaptive_ransac,
+                                           matcher=matcher, recorder=recorder, registration_scale=registration_scale)
+        except REGISTRATION_ERRORS:
+            if overlap is None:
+                raise
+            def get_pair_features(pair_overlap):
+                # The pivot is the growing stitched result, so its band and
+                # keypoint budget are sized by the join image.
+                pivot_overlap = pair_overlap
+                axis = 1 if stitch_direction == 1 else 0
+                pivot_ratio = float(pivot_img.shape[axis]) / join_img.shape[axis]
+                if pair_overlap is not None:
+                    pivot_overlap = (stitch_direction, min(1.0, pair_overlap[1] / pivot_ratio))
+                return (features.detect_scaled_features(pivot_img_path, pivot_img,
+                                                        int(np.ceil(features.NUM_KEYPOINTS * pivot_ratio)),
+                                                        overlap=pivot_overlap, recorder=recorder,
+                                                        scale=registration_scale),
+                        get_loaded_features(feature_cache, img_loader, reduced_loader, i, join_img, pair_overlap,
+                                            recorder))
+            recorder.set(overlap_fallback=True)
+            h_mat, _, pivot_features, join_features = register_image_pair_widening(
+                get_pair_features, widen_overlap(overlap), adaptive_ransac=adaptive_ransac, matcher=matcher,
+                recorder=recorder, registration_scale=registration_scale)
+        if refine:
+            h_mat = refine_image_pair(pivot_img, join_img, h_mat, adaptive_ransac=adaptive_ransac, matcher=matcher,
+                                      recorder=recorder, registration_scale=registration_scale)
+        stitched_img, crop_box = utils.composite_image_pair(pivot_img, join_img, h_mat, stitch_direction,
+                                                            blend=blend, blender=blender, recorder=recorder)
+
+        pivot_features = features.carry_features_forward(pivot_features, join_features, h_mat,
+                                                          pivot_img.shape, crop_box)
+        pivot_img = stitched_img
     
     return pivot_img
 
-def stitch_images_and_save(image_folder, image_filenames, stitch_direction, output_folder=None):
+def register_images(image_folder, image_filenames, adaptive_ransac=False, feature_cache=None, workers=None,
+                    overlap=None, matcher=None, recorder=None, registration_scale=1, manifest_path=None,
+                    settings=None, refine=False):
+
+    # With manifest_path, pairs whose two images are unchanged since the
+    # manifest was written reuse the stored homography; features are only
+    # detected for images of the pairs that still need registering.
+    if feature_cache is None:
+        feature_cache = features.FeatureCache()
+
+    img_paths = [os.path.join(image_folder, filename) for filename in image_filenames]
+    num_pairs = len(img_paths) - 1
+    cached_pairs, cached_shapes = {}, {}
+    if manifest_path is not None:
+        img_hashes = [utils.hash_file(img_path) for img_path in img_paths]
+        cached_pairs, cached_shapes = manifest.get_cached_registration(manifest.load_manifest(manifest_path), settings)
+        cached_pairs = {i: cached_pairs[(img_hashes[i], img_hashes[i + 1])] for i in range(num_pairs)
+                        if (img_hashes[i], img_hashes[i + 1]) in cached_pairs}
+        cached_shapes = [cached_shapes.get(img_hash) for img_hash in img_hashes]
+    else:
+        cached_shapes = [None] * len(img_paths)
+
+    stale_pairs = [i for i in range(num_pairs) if i not in cached_pairs]
+    needed = sorted(set(stale_pairs) | set(i + 1 for i in stale_pairs) |
+                    set(i for i, img_shape in enumerate(cached_shapes) if img_shape is None))
+    img_features = [None] * len(img_paths)
+
+    executor = create_executor(workers) if needed else None
+    if executor is None:
+        computed = features.get_features_for_paths([img_paths[i] for i in needed], feature_cache, overlap=overlap,
+                                                   recorder=recorder, scale=registration_scale)
+        for i, img_feature in zip(needed, computed):
+            img_features[i] = img_feature
+        stale_h_mats, stale_confidences = register_image_pairs(img_paths, img_features, feature_cache,
+                                                               adaptive_ransac=adaptive_ransac, overlap=overlap,
+                                                               matcher=matcher, recorder=recorder,
+                                                               registration_scale=registration_scale,
+                                                               pair_indices=stale_pairs)
+    else:
+        with executor:
+            computed = features.get_features_for_paths([img_paths[i] for i in needed], feature_cache,
+                                                       executor=executor, overlap=overlap, scale=registration_scale)
+            for i, img_feature in zip(needed, computed):
+                img_features[i] = img_feature
+            stale_h_mats, stale_confidences = register_image_pairs(img_paths, img_features, feature_cache,
+                                                                   adaptive_ransac=adaptive_ransac, overlap=overlap,
+                                                                   executor=executor, matcher=matcher,
+                                                                   recorder=recorder,
+                                                                   registration_scale=registration_scale,
+                                                                   pair_indices=stale_pairs)
+
+    if refine:
+        stale_h_mats = refine_image_pairs(img_paths, stale_pairs, stale_h_mats, adaptive_ransac=adaptive_ransac,
+                                          matcher=matcher, recorder=recorder, registration_scale=registration_scale)
+    for i, h_mat, confidence in zip(stale_pairs, stale_h_mats, stale_confidences):
+        cached_pairs[i] = (h_mat, confidence)
+    pair_h_mats = [cached_pairs[i][0] for i in range(num_pairs)]
+    img_shapes = [img_shape if img_feature is None else img_feature.img_shape
+                  for img_shape, img_feature in zip(cached_shapes, img_features)]
+
+    if manifest_path is not None and stale_pairs:
+        manifest.save_manifest(manifest_path, manifest.build_manifest(
+            image_filenames, img_hashes, img_shapes, pair_h_mats, [cached_pairs[i][1] for i in range(num_pairs)],
+            settings))
+    return utils.chain_homographies(pair_h_mats), img_shapes
+
+def stitch_images_global(image_folder, image_filenames, stitch_direction, adaptive_ransac=False, feature_cache=None,
+                         workers=None, overlap_fraction=None, matcher=None, blend=None, recorder=None,
+                         registration_scale=1, manifest_path=None, refine=False):
+
+    # Every adjacent pair of original images is registered, the pairwise
+    # homographies are chained into the first image's frame and each image is
+    # warped exactly once into an output allocated at its final size.
+    check_inputs(image_folder, image_filenames)
+    check_refine(refine, registration_scale)
+    settings = manifest.get_settings(stitch_direction, adaptive_ransac, overlap_fraction, matcher, registration_scale,
+                                     refine)
+    h_mats, img_shapes = register_images(image_folder, image_filenames, adaptive_ransac=adaptive_ransac,
+                                         feature_cache=feature_cache, workers=workers,
+                                         overlap=get_overlap(stitch_direction, overlap_fraction), matcher=matcher,
+                                         recorder=recorder, registration_scale=registration_scale,
+                                         manifest_path=manifest_path, settings=settings, refine=refine)
+
+    recorder = instrumentation.get_recorder(recorder)
+    recorder.begin("render")
+    with recorder.stage("crop"):
+        transfmd_corners_list = [utils.transform_with_homography(h_mat, utils.get_corners_as_array(*img_shape[:2]))
+                                 for h_mat, img_shape in zip(h_mats, img_shapes)]
+        crop_box = utils.get_global_crop_points(transfmd_corners_list, stitch_direction)
+
+    img_paths = [os.path.join(image_folder, filename) for filename in image_filenames]
+    with recorder.stage("warp"), loader.ImageLoader(img_paths) as img_loader:
+        canvas = utils.render_images_to_canvas(img_loader, h_mats, crop_box, blend=blend)
+    recorder.set(canvas_shape=list(canvas.shape))
+    recorder.track_arrays(canvas)
+    return canvas
+
+def stitch_images_tiled(image_folder, image_filenames, stitch_direction, output_path, tile_height=tiled.TILE_HEIGHT,
+                        adaptive_ransac=False, feature_cache=None, workers=None, overlap_fraction=None,
+                        matcher=None, recorder=None, registration_scale=1, manifest_path=None, refine=False):
+
+    # Same registration as the global mode, but the panorama is rendered strip
+    # by strip into a .npy memory map at output_path instead of into RAM.
+    check_inputs(image_folder, image_filenames)
+    check_refine(refine, registration_scale)
+    settings = manifest.get_settings(stitch_direction, adaptive_ransac, overlap_fraction, matcher, registration_scale,
+                                     refine)
+    h_mats, img_shapes = register_images(image_folder, image_filenames, adaptive_ransac=adaptive_ransac,
+                                         feature_cache=feature_cache, workers=workers,
+                                         overlap=get_overlap(stitch_direction, overlap_fraction), matcher=matcher,
+                                         recorder=recorder, registration_scale=registration_scale,
+                                         manifest_path=manifest_path, settings=settings, refine=refine)
+
+    recorder = instrumentation.get_recorder(recorder)
+    recorder.begin("render")
+    with recorder.stage("crop"):
+        transfmd_corners_list = [utils.transform_with_homography(h_mat, utils.get_corners_as_array(*img_shape[:2]))
+                                 for h_mat, img_shape in zip(h_mats, img_shapes)]
+        x_start, y_start, x_end, y_end = utils.get_global_crop_points(transfmd_corners_list, stitch_direction)
+
+    # Sources are decoded strip by strip as the renderer reaches them; the
+    # output is a memory map, so only the strip buffer and the decoded sources
+    # count as arrays.
+    output = tiled.open_output_memmap(output_path, (y_end - y_start, x_end - x_start, img_shapes[0][2]))
+    img_paths = [os.path.join(image_folder, filename) for filename in image_filenames]
+    with loader.ImageLoader(img_paths) as img_loader:
+        tiled.render_images_tiled(img_loader, h_mats, (x_start, y_start, x_end, y_end), output,
+                                  tile_height=tile_height, img_shapes=img_shapes, stitch_direc=stitch_direction,
+                                  recorder=recorder)
+    recorder.set(canvas_shape=list(output.shape))
+    return output
+
+def stitch_images_and_save(image_folder, image_filenames, stitch_direction, output_folder=None, adaptive_ransac=False,
+                           feature_cache=None, mode="incremental", workers=None, overlap_fraction=None,
+                           matcher=None, blend=None, recorder=None, registration_scale=1, manifest_path=None,
+                           output_ext=".jpg", refine=False):
 
     timestr = time.strftime("%Y%m%d_%H%M%S")
-    filename = "stitched_image_" + timestr + ".jpg"
-    stitched_img = stitch_images(image_folder, image_filenames, stitch_direction)
+    filename = "stitched_image_" + timestr + output_ext
+    stitched_img = stitch_images(image_folder, image_filenames, stitch_direction, adaptive_ransac=adaptive_ransac,
+                                 feature_cache=feature_cache, mode=mode, workers=workers,
+                                 overlap_fraction=overlap_fraction, matcher=matcher, blend=blend,
+                                 recorder=recorder, registration_scale=registration_scale,
+                                 manifest_path=manifest_path, refine=refine)
     if output_folder is None:
         if not os.path.isdir("output"):
             os.makedirs("output/")
         output_folder = "output"
     full_save_path = os.path.join(output_folder, filename)
-    _ = cv2.imwrite(full_save_path, stitched_img)
+    recorder = instrumentation.get_recorder(recorder)
+    recorder.begin("save", output=full_save_path)
+    with recorder.stage("save"):
+        utils.save_image_atomic(full_save_path, stitched_img)
     print("The stitched image is saved at: " + full_save_path)
+
+def stitch_images_from_manifest(image_folder, manifest_path, blend=None, feature_cache=None, workers=None,
+                                recorder=None):
+
+    # Render-only entry point: the image list and registration settings are
+    # taken from the manifest, and only pairs whose images changed since it
+    # was written are registered again.
+    saved_manifest = manifest.load_manifest(manifest_path)
+    if saved_manifest is None:
+        raise IOError("No usable registration manifest at: " + manifest_path)
+    settings = saved_manifest["settings"]
+    image_filenames = [entry["filename"] for entry in saved_manifest["images"]]
+    return stitch_images_global(image_folder, image_filenames, settings["stitch_direction"],
+                                adaptive_ransac=settings["adaptive_ransac"], feature_cache=feature_cache,
+                                workers=workers, overlap_fraction=settings["overlap_fraction"],
+                                matcher=settings["matcher"], blend=blend, recorder=recorder,
+                                registration_scale=settings["registration_scale"], manifest_path=manifest_path,
+                                refine=settings.get("refine", False))
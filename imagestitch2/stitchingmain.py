@@ -1,7 +1,6 @@
-import numpy as np
 import cv2
 import glob
-import imutils 
+from . import utils
 
 img_path = glob.glob("") #insert file path 
 img = [] 
@@ -26,29 +25,7 @@ if not error:
   cv2.imshow("Threshold Image", thresh_img)
   cv2.waitKey(0)
 
-  contours = cv2.findContours(thresh_img.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-  contours = imutils.grab_contours(contours)
-  areaOI = max(contours, key=cv2.contourArea)
-
-  mask = np.zeros(thresh_img.shape, dtype="uint8")
-  x, y, w, h = cv2.boundingRect(areaOI)
-  cv2.rectangle(mask, (x,y), (x + w, y + h), 255, -1)
-
-  minRectangle = mask.copy()
-  sub = mask.copy()
-
-  while cv2.countNonZero(sub) > 0:
-        minRectangle = cv2.erode(minRectangle, None)
-        sub = cv2.subtract(minRectangle, thresh_img)
-
-  contours = cv2.findContours(minRectangle.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-  contours = imutils.grab_contours(contours)
-  areaOI = max(contours, key=cv2.contourArea)
-
-  cv2.imshow("minRectangle Image", minRectangle)
-  cv2.waitKey(0)
-
-  x, y, w, h = cv2.boundingRect(areaOI)
+  x, y, w, h = utils.get_largest_valid_rect(thresh_img)
 
   stcImg = stcImg[y:y + h, x:x + w]
   cv2.imwrite("stitchedOutputProcessed.png", stcImg)
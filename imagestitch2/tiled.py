@@ -0,0 +1,123 @@
+from . import instrumentation
+from . import utils
+import numpy as np
+
+TILE_HEIGHT = 512
+SOURCE_MARGIN = 2
+
+
+def open_output_memmap(output_path, shape, dtype=np.uint8):
+
+    return np.lib.format.open_memmap(output_path, mode="w+", dtype=dtype, shape=shape)
+
+
+def get_source_window(h_mat_inv, tile_box, img_h, img_w):
+
+    # The tile's corners are mapped back through the inverse homography to find
+    # the part of the source image that can land in the tile.
+    x_start, y_start, x_end, y_end = tile_box
+    tile_corners = np.array([[x_start, y_start], [x_end, y_start], [x_end, y_end], [x_start, y_end]])
+    src_corners = utils.transform_with_homography(h_mat_inv, tile_corners)
+
+    src_x_start = max(0, int(np.floor(src_corners[:, 0].min())) - SOURCE_MARGIN)
+    src_y_start = max(0, int(np.floor(src_corners[:, 1].min())) - SOURCE_MARGIN)
+    src_x_end = min(img_w, int(np.ceil(src_corners[:, 0].max())) + SOURCE_MARGIN + 1)
+    src_y_end = min(img_h, int(np.ceil(src_corners[:, 1].max())) + SOURCE_MARGIN + 1)
+    if src_x_end <= src_x_start or src_y_end <= src_y_start:
+        return None
+    return src_x_start, src_y_start, src_x_end, src_y_end
+
+
+def render_tile(tile, tile_box, imgs, h_mats):
+
+    x_start, y_start, _, _ = tile_box
+    tile_h, tile_w = tile.shape[:2]
+
+    for img, h_mat in zip(reversed(imgs), reversed(h_mats)):
+        img_h, img_w = img.shape[:2]
+        transfmd_corners = utils.transform_with_homography(h_mat, utils.get_corners_as_array(img_h, img_w))
+        if (transfmd_corners[:, 0].max() < x_start or transfmd_corners[:, 0].min() >= x_start + tile_w or
+                transfmd_corners[:, 1].max() < y_start or transfmd_corners[:, 1].min() >= y_start + tile_h):
+            continue
+
+        src_window = get_source_window(np.linalg.inv(h_mat), tile_box, img_h, img_w)
+        if src_window is None:
+            continue
+        src_x_start, src_y_start, src_x_end, src_y_end = src_window
+
+        # Source window -> panorama -> tile coordinates.
+        tile_h_mat = np.matmul(utils.get_translation_matrix(-x_start, -y_start),
+                               np.matmul(h_mat, utils.get_translation_matrix(src_x_start, src_y_start)))
+        utils.warp_image_into_canvas(tile, img[src_y_start:src_y_end, src_x_start:src_x_end], tile_h_mat)
+
+
+def get_strip_range(h_mat, img_shape, axis, out_size, tile_height):
+
+    # First and last strip index that the warped image reaches along axis
+    # (0 for x, 1 for y), or None if it lies outside the output.
+    img_h, img_w = img_shape[:2]
+    transfmd_corners = utils.transform_with_homography(h_mat, utils.get_corners_as_array(img_h, img_w))
+    start = max(0, int(np.floor(transfmd_corners[:, axis].min())))
+    end = min(out_size, int(np.ceil(transfmd_corners[:, axis].max())) + 1)
+    if end <= start:
+        return None
+    return start // tile_height, (end - 1) // tile_height
+
+
+def render_images_tiled(imgs, h_mats, crop_box, output, tile_height=TILE_HEIGHT, img_shapes=None, stitch_direc=0,
+                        recorder=None):
+
+    # The panorama is produced one strip at a time, cut across the stitch
+    # direction (columns for stitch_direc 1, rows otherwise), and each strip is
+    # copied into output, which is typically a memory map. imgs is indexed
+    # lazily (a loader.ImageLoader decodes on access): a source is decoded for
+    # the first strip its footprint reaches and released after the last one, so
+    # only the sources overlapping the current strip are held in memory.
+    x_start, y_start, x_end, y_end = crop_box
+    out_h, out_w = output.shape[:2]
+    offset_h_mat = utils.get_translation_matrix(-x_start, -y_start)
+    h_mats = [np.matmul(offset_h_mat, h_mat) for h_mat in h_mats]
+    if img_shapes is None:
+        img_shapes = [img.shape for img in imgs]
+    recorder = instrumentation.get_recorder(recorder)
+
+    axis = 0 if stitch_direc == 1 else 1
+    out_size = out_w if axis == 0 else out_h
+    strip_ranges = [get_strip_range(h_mat, img_shape, axis, out_size, tile_height)
+                    for h_mat, img_shape in zip(h_mats, img_shapes)]
+
+    if axis == 0:
+        tile = np.zeros((out_h, min(tile_height, out_w)) + output.shape[2:], dtype=output.dtype)
+    else:
+        tile = np.zeros((min(tile_height, out_h), out_w) + output.shape[2:], dtype=output.dtype)
+    decoded = {}
+    for strip_index, strip_start in enumerate(range(0, out_size, tile_height)):
+        strip_end = min(out_size, strip_start + tile_height)
+        needed = [i for i, strip_range in enumerate(strip_ranges)
+                  if strip_range is not None and strip_range[0] <= strip_index <= strip_range[1]]
+        with recorder.stage("decode"):
+            for i in needed:
+                if i not in decoded:
+                    decoded[i] = imgs[i]
+        recorder.track_arrays(tile, *decoded.values())
+
+        with recorder.stage("warp"):
+            if axis == 0:
+                tile_view = tile[:, 0:strip_end - strip_start]
+                tile_box = (strip_start, 0, strip_end, out_h)
+            else:
+                tile_view = tile[0:strip_end - strip_start]
+                tile_box = (0, strip_start, out_w, strip_end)
+            tile_view[...] = 0
+            render_tile(tile_view, tile_box, [decoded[i] for i in needed], [h_mats[i] for i in needed])
+            if axis == 0:
+                output[:, strip_start:strip_end] = tile_view
+            else:
+                output[strip_start:strip_end] = tile_view
+
+        for i in needed:
+            if strip_ranges[i][1] == strip_index:
+                del decoded[i]
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output
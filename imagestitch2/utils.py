@@ -1,52 +1,234 @@
 import cv2
+import hashlib
 import numpy as np
 import os
-import re
-from imgstitch import exceptions
+from . import exceptions
+from . import matchers
+from . import scoring
+from . import blending
+from . import instrumentation
 
 MINIMUM_MATCH_POINTS = 20
 CONFIDENCE_THRESH = 65 
-
-def get_matches(img_a_gray, img_b_gray, num_keypoints=1000, threshold=0.8):
+RANSAC_BATCH_SIZE = 256
+RANSAC_SAMPLE_SIZE = 5
+RANSAC_SUCCESS_PROB = 0.995
+ADAPTIVE_MAX_ITERATIONS = 2000
+ADAPTIVE_MIN_BATCH_SIZE = 8
+LO_MAX_ITERATIONS = 5
+PYRAMID_WINDOW_RADIUS = 8
+GUIDED_MATCH_CHUNK_SIZE = 256
+OVERLAP_WIDEN_FACTOR = 2.0
+RANSAC_INLIER_THRESHOLD = 3
+IMAGE_SIGNATURES = ((b"\xff\xd8\xff", "jpeg"), (b"\x89PNG\r\n\x1a\n", "png"))
+IMAGE_HEADER_LENGTH = 8
+
+def detect_features(img_gray, num_keypoints=1000, mask=None):
+
+    # ORB builds its scale pyramid over the whole input even when a mask is
+    # given, so the image is first cropped to the bounding box of the mask.
+    x_start, y_start = 0, 0
+    if mask is not None:
+        x_start, y_start, roi_w, roi_h = cv2.boundingRect(mask)
+        if roi_w == 0 or roi_h == 0:
+            return np.zeros((0, 2)), np.zeros((0, 32), dtype=np.uint8)
+        img_gray = img_gray[y_start:y_start + roi_h, x_start:x_start + roi_w]
+        mask = mask[y_start:y_start + roi_h, x_start:x_start + roi_w]
 
     orb = cv2.ORB_create(nfeatures=num_keypoints)
-    kp_a, desc_a = orb.detectAndCompute(img_a_gray, None)
-    kp_b, desc_b = orb.detectAndCompute(img_b_gray, None)
-    
-    dis_matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
-    matches_list = dis_matcher.knnMatch(desc_a, desc_b, k=2) 
+    keypoints, descriptors = orb.detectAndCompute(img_gray, mask)
+    if descriptors is None:
+        return np.zeros((0, 2)), np.zeros((0, 32), dtype=np.uint8)
+
+    points = cv2.KeyPoint_convert(keypoints).astype(np.float64) + np.array([x_start, y_start])
+    return points, descriptors
+
+
+def ratio_test(knn_matches, threshold=0.8, allow_single=False):
+
+    # knn_matches is the structured array returned by the matcher backends;
+    # rows without a second neighbour fail the test unless allow_single is set.
+    distances = knn_matches["distance"]
+    has_first = knn_matches["train_idx"][:, 0] >= 0
+    has_second = knn_matches["train_idx"][:, 1] >= 0
+    good = has_first & has_second & (distances[:, 0] < threshold * distances[:, 1])
+    if allow_single:
+        good |= has_first & ~has_second
+    return good
+
+
+def select_matched_points(points_a, points_b, knn_matches, good):
+
+    query_idx = np.flatnonzero(good)
+    train_idx = knn_matches["train_idx"][query_idx, 0]
+    if query_idx.shape[0] < MINIMUM_MATCH_POINTS:
+        raise exceptions.NotEnoughMatchPointsError(query_idx.shape[0], MINIMUM_MATCH_POINTS)
+    return points_a[query_idx], points_b[train_idx]
+
+
+def match_features(points_a, desc_a, points_b, desc_b, threshold=0.8, matcher=None):
+
+    if desc_a.shape[0] < 2 or desc_b.shape[0] < 2:
+        raise exceptions.NotEnoughMatchPointsError(0, MINIMUM_MATCH_POINTS)
+
+    dis_matcher = matchers.get_matcher(matcher)
+    knn_matches = dis_matcher.knn_match(desc_a, desc_b, k=2)
+    good = ratio_test(knn_matches, threshold)
+    return select_matched_points(points_a, points_b, knn_matches, good)
+
+
+def guided_match_features(points_a, desc_a, points_b, desc_b, h_mat, window_radius=PYRAMID_WINDOW_RADIUS,
+                          threshold=0.8, matcher=None):
+
+    if desc_a.shape[0] == 0 or desc_b.shape[0] == 0:
+        raise exceptions.NotEnoughMatchPointsError(0, MINIMUM_MATCH_POINTS)
+
+    # Candidates for each keypoint of img_a are only the img_b keypoints that
+    # h_mat predicts to land within window_radius of it. A keypoint with a
+    # single candidate in its window is accepted without the ratio test. img_a
+    # is handled in chunks, each matched only against the img_b keypoints in
+    # its windows, so no distance table spans all pairs of keypoints.
+    predicted_b = transform_with_homography(h_mat, points_b)
+    dis_matcher = matchers.get_matcher(matcher)
+    knn_matches = matchers.empty_knn_matches(points_a.shape[0], 2)
+    for start in range(0, points_a.shape[0], GUIDED_MATCH_CHUNK_SIZE):
+        stop = start + GUIDED_MATCH_CHUNK_SIZE
+        sq_dis = np.sum(np.square(points_a[start:stop, np.newaxis, :] - predicted_b[np.newaxis, :, :]), axis=2)
+        window_mask = sq_dis <= window_radius**2
+        candidates = np.flatnonzero(window_mask.any(axis=0))
+        if candidates.size == 0:
+            continue
+        chunk_matches = dis_matcher.knn_match(desc_a[start:stop], desc_b[candidates], k=2,
+                                              mask=window_mask[:, candidates].astype(np.uint8))
+        found = chunk_matches["train_idx"] >= 0
+        chunk_matches["train_idx"][found] = candidates[chunk_matches["train_idx"][found]]
+        knn_matches[start:stop] = chunk_matches
+    good = ratio_test(knn_matches, threshold, allow_single=True)
+    return select_matched_points(points_a, points_b, knn_matches, good)
+
+
+def get_overlap_mask(img_shape, stitch_direc, side, fraction):
+
+    # side "a" is the image the other one is joined onto, so its trailing edge
+    # (right or bottom) faces the overlap; side "b" faces it with its leading
+    # edge.
+    img_h, img_w = img_shape[:2]
+    mask = np.zeros((img_h, img_w), dtype=np.uint8)
+    if stitch_direc == 1:
+        band = int(np.ceil(img_w * min(1.0, fraction)))
+        if side == "a":
+            mask[:, img_w - band:] = 255
+        else:
+            mask[:, :band] = 255
+    else:
+        band = int(np.ceil(img_h * min(1.0, fraction)))
+        if side == "a":
+            mask[img_h - band:, :] = 255
+        else:
+            mask[:band, :] = 255
+    return mask
+
+
+def get_band_keypoints(num_keypoints, fraction):
+
+    # Keypoints for an edge band, in proportion to its share of the image, so
+    # that it is detected at the density of the full image.
+    return max(1, int(np.ceil(num_keypoints * min(1.0, fraction))))
+
+
+def get_matches_in_overlap(img_a_gray, img_b_gray, num_keypoints=1000, threshold=0.8, stitch_direc=1,
+                           overlap_fraction=0.3, matcher=None):
+
+    # Keypoints are only detected in the bands along the facing edges. The band
+    # widens until enough matches are found, ending with the full images.
+    fraction = overlap_fraction
+    while True:
+        mask_a = get_overlap_mask(img_a_gray.shape, stitch_direc, "a", fraction)
+        mask_b = get_overlap_mask(img_b_gray.shape, stitch_direc, "b", fraction)
+        band_keypoints = get_band_keypoints(num_keypoints, fraction)
+        points_a, desc_a = detect_features(img_a_gray, band_keypoints, mask_a)
+        points_b, desc_b = detect_features(img_b_gray, band_keypoints, mask_b)
+        try:
+            return match_features(points_a, desc_a, points_b, desc_b, threshold, matcher)
+        except exceptions.NotEnoughMatchPointsError:
+            if fraction >= 1.0:
+                raise
+            fraction = min(1.0, fraction * OVERLAP_WIDEN_FACTOR)
+
+
+def get_predicted_overlap_mask(h_mat, img_shape, other_img_shape, dilate_px):
+
+    # Pixels of an image that the other image covers once mapped through h_mat.
+    other_h, other_w = other_img_shape[:2]
+    img_h, img_w = img_shape[:2]
+    covered = cv2.warpPerspective(np.full((other_h, other_w), 255, dtype=np.uint8), h_mat, (img_w, img_h),
+                                  flags=cv2.INTER_NEAREST)
+    if dilate_px > 0:
+        kernel = np.ones((2 * dilate_px + 1, 2 * dilate_px + 1), dtype=np.uint8)
+        covered = cv2.dilate(covered, kernel)
+    return covered
+
+
+def get_matches_pyramid(img_a_gray, img_b_gray, num_keypoints=1000, threshold=0.8, pyramid_levels=2,
+                        stitch_direc=None, overlap_fraction=None, window_radius=PYRAMID_WINDOW_RADIUS, matcher=None):
+
+    # Coarse: register downsampled images, restricted to the facing edges when
+    # the stitch direction is known.
+    small_a, small_b = img_a_gray, img_b_gray
+    for _ in range(pyramid_levels):
+        small_a = cv2.pyrDown(small_a)
+        small_b = cv2.pyrDown(small_b)
+    if stitch_direc is not None:
+        coarse_a, coarse_b = get_matches_in_overlap(small_a, small_b, num_keypoints, threshold, stitch_direc,
+                                                    overlap_fraction if overlap_fraction is not None else 0.5,
+                                                    matcher)
+    else:
+        points_a, desc_a = detect_features(small_a, num_keypoints)
+        points_b, desc_b = detect_features(small_b, num_keypoints)
+        coarse_a, coarse_b = match_features(points_a, desc_a, points_b, desc_b, threshold, matcher)
+    coarse_h_mat, _, _ = compute_homography_ransac_adaptive(coarse_a, coarse_b)
 
-    good_matches_list = []
-    for match_1, match_2 in matches_list:
-        if match_1.distance < threshold * match_2.distance:
-            good_matches_list.append(match_1)
+    scale = 2 ** pyramid_levels
+    scale_mat = np.diag([scale, scale, 1.0])
+    h_mat = np.matmul(scale_mat, np.matmul(coarse_h_mat, np.linalg.inv(scale_mat)))
 
-    good_kp_a = []
-    good_kp_b = []
+    try:
+        return get_matches_refined(img_a_gray, img_b_gray, h_mat, num_keypoints, threshold, window_radius, matcher)
+    except exceptions.NotEnoughMatchPointsError:
+        return coarse_a * scale, coarse_b * scale
 
-    for match in good_matches_list:
-        good_kp_a.append(kp_a[match.queryIdx].pt) 
-        good_kp_b.append(kp_b[match.trainIdx].pt)
-    
-    if len(good_kp_a) < MINIMUM_MATCH_POINTS:
-        raise exceptions.NotEnoughMatchPointsError(len(good_kp_a), MINIMUM_MATCH_POINTS)
-    
-    return np.array(good_kp_a), np.array(good_kp_b)
 
+def get_matches_refined(img_a_gray, img_b_gray, h_mat, num_keypoints=1000, threshold=0.8,
+                        window_radius=PYRAMID_WINDOW_RADIUS, matcher=None):
 
-def calculate_homography(points_img_a, points_img_b):
+    # Fine stage of a coarse-to-fine registration: detect at full resolution
+    # only inside the overlap h_mat predicts and match each keypoint only
+    # against keypoints inside its predicted window.
+    mask_a = get_predicted_overlap_mask(h_mat, img_a_gray.shape, img_b_gray.shape, window_radius)
+    mask_b = get_predicted_overlap_mask(np.linalg.inv(h_mat), img_b_gray.shape, img_a_gray.shape, window_radius)
+    points_a, desc_a = detect_features(img_a_gray, num_keypoints, mask_a)
+    points_b, desc_b = detect_features(img_b_gray, num_keypoints, mask_b)
+    return guided_match_features(points_a, desc_a, points_b, desc_b, h_mat, window_radius, threshold, matcher)
 
-    points_a_and_b = np.concatenate((points_img_a, points_img_b), axis=1)
-    A = []
 
-    for u, v, x, y in points_a_and_b:
-        A.append([-x, -y, -1, 0, 0, 0, u*x, u*y, u])
-        A.append([0, 0, 0, -x, -y, -1, v*x, v*y, v])
-    
-    A = np.array(A)
-    _, _, v_t = np.linalg.svd(A)
+def get_matches(img_a_gray, img_b_gray, num_keypoints=1000, threshold=0.8, pyramid_levels=0, stitch_direc=None,
+                overlap_fraction=None, matcher=None):
+
+    if pyramid_levels > 0:
+        return get_matches_pyramid(img_a_gray, img_b_gray, num_keypoints, threshold, pyramid_levels, stitch_direc,
+                                   overlap_fraction, matcher=matcher)
+    if overlap_fraction is not None and stitch_direc is not None:
+        return get_matches_in_overlap(img_a_gray, img_b_gray, num_keypoints, threshold, stitch_direc,
+                                      overlap_fraction, matcher)
+
+    points_a, desc_a = detect_features(img_a_gray, num_keypoints)
+    points_b, desc_b = detect_features(img_b_gray, num_keypoints)
+    return match_features(points_a, desc_a, points_b, desc_b, threshold, matcher)
 
-    h_mat = v_t[-1, :].reshape(3,3)
+
+def calculate_homography(points_img_a, points_img_b, dtype=np.float64):
+
+    h_mat = calculate_homography_batch(points_img_a[np.newaxis], points_img_b[np.newaxis], dtype=dtype)[0]
     return h_mat
 
 def transform_with_homography(h_mat, points_array):
@@ -60,50 +242,192 @@ def transform_with_homography(h_mat, points_array):
     return transformed_points
 
 
-def compute_outliers(h_mat, points_img_a, points_img_b, threshold=3):
+def compute_outliers(h_mat, points_img_a, points_img_b, threshold=RANSAC_INLIER_THRESHOLD):
 
-    num_points = points_img_a.shape[0]
-    outliers_count = 0
+    outliers_count = compute_outliers_batch(h_mat[np.newaxis], points_img_a, points_img_b, threshold)[0]
+    return int(outliers_count)
 
 
-    points_img_b_hat = transform_with_homography(h_mat, points_img_b)
-    
-    x = points_img_a[:, 0]
-    y = points_img_a[:, 1]
-    x_hat = points_img_b_hat[:, 0]
-    y_hat = points_img_b_hat[:, 1]
-    euclid_dis = np.sqrt(np.power((x_hat - x), 2) + np.power((y_hat - y), 2)).reshape(-1)
-    for dis in euclid_dis:
-        if dis > threshold:
-            outliers_count += 1
-    return outliers_count
+def draw_minimal_samples(num_points, num_samples, sample_size):
+
+    rand_keys = np.random.random((num_samples, num_points))
+    if sample_size >= num_points:
+        return np.argsort(rand_keys, axis=1)[:, :sample_size]
+    return np.argpartition(rand_keys, sample_size, axis=1)[:, :sample_size]
+
+
+def get_normalization_matrices(samples):
+
+    # Hartley conditioning: move each point set's centroid to the origin and
+    # scale it so the mean distance from the origin is sqrt(2).
+    centroids = samples.mean(axis=-2)
+    mean_dis = np.sqrt(np.sum(np.square(samples - centroids[..., np.newaxis, :]), axis=-1)).mean(axis=-1)
+    scales = np.sqrt(2.0) / np.maximum(mean_dis, 1e-12)
+
+    norm_mats = np.zeros(samples.shape[:-2] + (3, 3), dtype=samples.dtype)
+    norm_mats[..., 0, 0] = scales
+    norm_mats[..., 1, 1] = scales
+    norm_mats[..., 0, 2] = -scales * centroids[..., 0]
+    norm_mats[..., 1, 2] = -scales * centroids[..., 1]
+    norm_mats[..., 2, 2] = 1.0
+
+    inv_norm_mats = np.zeros_like(norm_mats)
+    inv_norm_mats[..., 0, 0] = 1.0 / scales
+    inv_norm_mats[..., 1, 1] = 1.0 / scales
+    inv_norm_mats[..., 0, 2] = centroids[..., 0]
+    inv_norm_mats[..., 1, 2] = centroids[..., 1]
+    inv_norm_mats[..., 2, 2] = 1.0
+    return norm_mats, inv_norm_mats
+
 
+def calculate_homography_batch(samples_img_a, samples_img_b, dtype=np.float64):
 
-def compute_homography_ransac(matches_a, matches_b):
+    samples_img_a = np.asarray(samples_img_a, dtype=dtype)
+    samples_img_b = np.asarray(samples_img_b, dtype=dtype)
+    norm_mats_a, inv_norm_mats_a = get_normalization_matrices(samples_img_a)
+    norm_mats_b, _ = get_normalization_matrices(samples_img_b)
+
+    u = samples_img_a[..., 0] * norm_mats_a[:, 0:1, 0] + norm_mats_a[:, 0:1, 2]
+    v = samples_img_a[..., 1] * norm_mats_a[:, 1:2, 1] + norm_mats_a[:, 1:2, 2]
+    x = samples_img_b[..., 0] * norm_mats_b[:, 0:1, 0] + norm_mats_b[:, 0:1, 2]
+    y = samples_img_b[..., 1] * norm_mats_b[:, 1:2, 1] + norm_mats_b[:, 1:2, 2]
+    zeros = np.zeros_like(x)
+    ones = np.ones_like(x)
+
+    rows_u = np.stack((-x, -y, -ones, zeros, zeros, zeros, u*x, u*y, u), axis=-1)
+    rows_v = np.stack((zeros, zeros, zeros, -x, -y, -ones, v*x, v*y, v), axis=-1)
+    A = np.concatenate((rows_u, rows_v), axis=1)
+
+    # The null vector of A is the eigenvector of the 9x9 normal matrix A^T A
+    # with the smallest eigenvalue; eigh returns eigenvalues in ascending order.
+    normal_mats = np.matmul(A.transpose(0, 2, 1), A)
+    _, eig_vecs = np.linalg.eigh(normal_mats)
+    h_mats_norm = eig_vecs[:, :, 0].reshape(-1, 3, 3)
+
+    h_mats = np.matmul(inv_norm_mats_a, np.matmul(h_mats_norm, norm_mats_b))
+    return h_mats.astype(np.float64)
+
+
+def compute_outliers_batch(h_mats, points_img_a, points_img_b, threshold=RANSAC_INLIER_THRESHOLD, buffers=None):
+
+    if buffers is None:
+        buffers = scoring.ScoringBuffers(points_img_a, points_img_b, h_mats.shape[0])
+    inliers_count = scoring.score_homographies(h_mats, buffers, threshold)
+    return points_img_a.shape[0] - inliers_count
+
+
+def compute_inliers_mask(h_mat, points_img_a, points_img_b, threshold=RANSAC_INLIER_THRESHOLD, buffers=None):
+
+    if buffers is None:
+        buffers = scoring.ScoringBuffers(points_img_a, points_img_b, 1)
+    inliers_mask = scoring.score_homographies(h_mat[np.newaxis], buffers, threshold, return_masks=True)[0]
+    return inliers_mask.copy()
+
+
+def required_ransac_iterations(inlier_ratio, sample_size=RANSAC_SAMPLE_SIZE, success_prob=RANSAC_SUCCESS_PROB,
+                               max_iterations=ADAPTIVE_MAX_ITERATIONS):
+
+    good_sample_prob = inlier_ratio ** sample_size
+    if good_sample_prob >= 1.0:
+        return 1
+    if good_sample_prob <= 0.0:
+        return max_iterations
+    num_iterations = np.ceil(np.log(1.0 - success_prob) / np.log(1.0 - good_sample_prob))
+    return int(max(1, min(max_iterations, num_iterations)))
+
+
+def fixed_ransac_iterations(sample_size=RANSAC_SAMPLE_SIZE, success_prob=RANSAC_SUCCESS_PROB):
+
+    return int(np.log(1.0 - success_prob)/np.log(1 - 0.5**sample_size))
+
+
+def compute_homography_ransac(matches_a, matches_b, batch_size=RANSAC_BATCH_SIZE, adaptive=False, dtype=np.float64,
+                              threshold=RANSAC_INLIER_THRESHOLD):
+
+    # threshold is the inlier reprojection distance in pixels of the matched
+    # points' coordinates.
+    if adaptive:
+        best_h_mat, _, _ = compute_homography_ransac_adaptive(matches_a, matches_b, dtype=dtype, threshold=threshold)
+        return best_h_mat
 
     num_all_matches =  matches_a.shape[0]
-    SAMPLE_SIZE = 5 
-    SUCCESS_PROB = 0.995 
-    min_iterations = int(np.log(1.0 - SUCCESS_PROB)/np.log(1 - 0.5**SAMPLE_SIZE))
+    SAMPLE_SIZE = RANSAC_SAMPLE_SIZE
+    min_iterations = fixed_ransac_iterations()
     
     lowest_outliers_count = num_all_matches
     best_h_mat = None
-    best_i = 0 
-
-    for i in range(min_iterations):
-        rand_ind = np.random.permutation(range(num_all_matches))[:SAMPLE_SIZE]
-        h_mat = calculate_homography(matches_a[rand_ind], matches_b[rand_ind])
-        outliers_count = compute_outliers(h_mat, matches_a, matches_b)
-        if outliers_count < lowest_outliers_count:
-            best_h_mat = h_mat
-            lowest_outliers_count = outliers_count
-            best_i = i
+
+    # All minimal samples are drawn up front and every hypothesis in a batch is
+    # solved and scored at once, instead of one calculate_homography call per loop.
+    sample_ind = draw_minimal_samples(num_all_matches, min_iterations, SAMPLE_SIZE)
+    buffers = scoring.ScoringBuffers(matches_a, matches_b, min(batch_size, min_iterations))
+    for start in range(0, min_iterations, batch_size):
+        batch_ind = sample_ind[start:start + batch_size]
+        h_mats = calculate_homography_batch(matches_a[batch_ind], matches_b[batch_ind], dtype=dtype)
+        outliers_counts = compute_outliers_batch(h_mats, matches_a, matches_b, threshold, buffers=buffers)
+        batch_best = int(np.argmin(outliers_counts))
+        if outliers_counts[batch_best] < lowest_outliers_count:
+            best_h_mat = h_mats[batch_best]
+            lowest_outliers_count = outliers_counts[batch_best]
     best_confidence_obtained = int(100 - (100 * lowest_outliers_count / num_all_matches))
     if best_confidence_obtained < CONFIDENCE_THRESH:
         raise(exceptions.MatchesNotConfident(best_confidence_obtained))
     return best_h_mat
 
 
+def compute_homography_ransac_adaptive(matches_a, matches_b, max_iterations=ADAPTIVE_MAX_ITERATIONS,
+                                       max_batch_size=RANSAC_BATCH_SIZE, dtype=np.float64,
+                                       threshold=RANSAC_INLIER_THRESHOLD):
+
+    num_all_matches = matches_a.shape[0]
+    lowest_outliers_count = num_all_matches
+    best_h_mat = None
+
+    # The iteration budget is recomputed from the best inlier ratio seen so far,
+    # so well-overlapping pairs stop after the first few hypotheses while hard
+    # pairs may use up to max_iterations. Batches start small and grow.
+    num_iterations = 0
+    required_iterations = max_iterations
+    batch_size = ADAPTIVE_MIN_BATCH_SIZE
+    buffers = scoring.ScoringBuffers(matches_a, matches_b, max(batch_size, max_batch_size))
+    while num_iterations < required_iterations:
+        num_samples = min(batch_size, required_iterations - num_iterations)
+        batch_ind = draw_minimal_samples(num_all_matches, num_samples, RANSAC_SAMPLE_SIZE)
+        h_mats = calculate_homography_batch(matches_a[batch_ind], matches_b[batch_ind], dtype=dtype)
+        outliers_counts = compute_outliers_batch(h_mats, matches_a, matches_b, threshold, buffers=buffers)
+        num_iterations += num_samples
+
+        batch_best = int(np.argmin(outliers_counts))
+        if outliers_counts[batch_best] < lowest_outliers_count:
+            best_h_mat = h_mats[batch_best]
+            lowest_outliers_count = outliers_counts[batch_best]
+            inlier_ratio = 1.0 - lowest_outliers_count / num_all_matches
+            required_iterations = required_ransac_iterations(inlier_ratio, max_iterations=max_iterations)
+        batch_size = min(2 * batch_size, max_batch_size)
+
+    # Local optimisation: refit on all inliers by least squares and keep the
+    # refit while it does not lose inliers.
+    inliers_mask = compute_inliers_mask(best_h_mat, matches_a, matches_b, threshold, buffers=buffers)
+    for _ in range(LO_MAX_ITERATIONS):
+        if np.count_nonzero(inliers_mask) < RANSAC_SAMPLE_SIZE:
+            break
+        refit_h_mat = calculate_homography(matches_a[inliers_mask], matches_b[inliers_mask])
+        refit_inliers_mask = compute_inliers_mask(refit_h_mat, matches_a, matches_b, threshold, buffers=buffers)
+        if np.count_nonzero(refit_inliers_mask) < np.count_nonzero(inliers_mask):
+            break
+        grew = np.count_nonzero(refit_inliers_mask) > np.count_nonzero(inliers_mask)
+        best_h_mat = refit_h_mat
+        inliers_mask = refit_inliers_mask
+        if not grew:
+            break
+
+    lowest_outliers_count = num_all_matches - np.count_nonzero(inliers_mask)
+    best_confidence_obtained = int(100 - (100 * lowest_outliers_count / num_all_matches))
+    if best_confidence_obtained < CONFIDENCE_THRESH:
+        raise(exceptions.MatchesNotConfident(best_confidence_obtained))
+    return best_h_mat, inliers_mask, num_iterations
+
+
 def get_corners_as_array(img_height, img_width):
 
     corners_array = np.array([[0, 0],
@@ -199,33 +523,292 @@ def get_crop_points(h_mat, img_a, img_b, stitch_direc):
     return x_start, y_start, x_end, y_end
 
 
-def stitch_image_pair(img_a, img_b, stitch_direc):
-    img_a_gray = cv2.cvtColor(img_a, cv2.COLOR_BGR2GRAY)
-    img_b_gray = cv2.cvtColor(img_b, cv2.COLOR_BGR2GRAY)
-    matches_a, matches_b = get_matches(img_a_gray, img_b_gray, num_keypoints=1000, threshold=0.8)
-    h_mat = compute_homography_ransac(matches_a, matches_b)
-    if stitch_direc == 0:
-        canvas = cv2.warpPerspective(img_b, h_mat, (img_a.shape[1], img_a.shape[0] + img_b.shape[0]))
-        canvas[0:img_a.shape[0], :, :] = img_a[:, :, :]
-        x_start, y_start, x_end, y_end = get_crop_points(h_mat, img_a, img_b, 0)
-    else:
-        canvas = cv2.warpPerspective(img_b, h_mat, (img_a.shape[1] + img_b.shape[1], img_a.shape[0]))
-        canvas[:, 0:img_a.shape[1], :] = img_a[:, :, :]
-        x_start, y_start, x_end, y_end = get_crop_points(h_mat, img_a, img_b, 1)
+def warp_mask_into_box(img_shape, h_mat, box):
+
+    x_start, y_start, x_end, y_end = box
+    roi_h_mat = np.matmul(get_translation_matrix(-x_start, -y_start), h_mat)
+    return cv2.warpPerspective(np.full(img_shape[:2], 255, dtype=np.uint8), roi_h_mat,
+                               (x_end - x_start, y_end - y_start), flags=cv2.INTER_NEAREST)
+
+
+def get_overlap_box(h_mat, img_a_shape, img_b_shape, canvas_shape, margin=1):
+
+    # Bounding box of warped img_b inside img_a, grown by margin so both images'
+    # borders fall inside it, clipped to the canvas.
+    img_a_h, img_a_w = img_a_shape[:2]
+    transfmd_corners = transform_with_homography(h_mat, get_corners_as_array(*img_b_shape[:2]))
+    x_start = max(0, int(np.floor(transfmd_corners[:, 0].min())) - margin)
+    y_start = max(0, int(np.floor(transfmd_corners[:, 1].min())) - margin)
+    x_end = min(img_a_w + margin, canvas_shape[1], int(np.ceil(transfmd_corners[:, 0].max())) + 1 + margin)
+    y_end = min(img_a_h + margin, canvas_shape[0], int(np.ceil(transfmd_corners[:, 1].max())) + 1 + margin)
+    if x_end <= x_start or y_end <= y_start:
+        return None
+    return x_start, y_start, x_end, y_end
+
+
+def composite_image_pair(img_a, img_b, h_mat, stitch_direc, blend=None, blender=None, recorder=None):
+
+    recorder = instrumentation.get_recorder(recorder)
+    with recorder.stage("warp"):
+        if stitch_direc == 0:
+            canvas = cv2.warpPerspective(img_b, h_mat, (img_a.shape[1], img_a.shape[0] + img_b.shape[0]))
+        else:
+            canvas = cv2.warpPerspective(img_b, h_mat, (img_a.shape[1] + img_b.shape[1], img_a.shape[0]))
+
+        # With blending, the warped img_b pixels of the overlap are kept aside before
+        # img_a is pasted over them, and the two are then blended in that box only.
+        overlap_box = None
+        if blend is not None:
+            overlap_box = get_overlap_box(h_mat, img_a.shape, img_b.shape, canvas.shape)
+        if overlap_box is not None:
+            x_start, y_start, x_end, y_end = overlap_box
+            overlap_b = canvas[y_start:y_end, x_start:x_end].copy()
+            mask_b = warp_mask_into_box(img_b.shape, h_mat, overlap_box)
+
+        canvas[0:img_a.shape[0], 0:img_a.shape[1], :] = img_a[:, :, :]
+
+        if overlap_box is not None:
+            mask_a = np.zeros(mask_b.shape, dtype=np.uint8)
+            mask_a[0:img_a.shape[0] - y_start, 0:img_a.shape[1] - x_start] = 255
+            blending.blend_overlap(canvas[y_start:y_end, x_start:x_end], mask_a, overlap_b, mask_b, blend, blender)
+    recorder.set(canvas_shape=list(canvas.shape))
+    recorder.track_arrays(img_a, img_b, canvas)
+
+    with recorder.stage("crop"):
+        if stitch_direc == 0:
+            x_start, y_start, x_end, y_end = get_crop_points(h_mat, img_a, img_b, 0)
+        else:
+            x_start, y_start, x_end, y_end = get_crop_points(h_mat, img_a, img_b, 1)
     
     stitched_img = canvas[y_start:y_end,x_start:x_end,:]
-    return stitched_img
+    return stitched_img, (x_start, y_start, x_end, y_end)
+
+
+def get_translation_matrix(t_x, t_y):
+
+    return np.array([[1.0, 0.0, t_x],
+                     [0.0, 1.0, t_y],
+                     [0.0, 0.0, 1.0]])
+
+
+def chain_homographies(pair_h_mats):
+
+    h_mats = [np.eye(3)]
+    for pair_h_mat in pair_h_mats:
+        h_mat = np.matmul(h_mats[-1], pair_h_mat)
+        h_mats.append(h_mat / h_mat[2, 2])
+    return h_mats
+
+
+def get_global_crop_points(transfmd_corners_list, stitch_direc):
+
+    tops = [max(corners[0, 1], corners[1, 1]) for corners in transfmd_corners_list]
+    bottoms = [min(corners[2, 1], corners[3, 1]) for corners in transfmd_corners_list]
+    lefts = [max(corners[0, 0], corners[3, 0]) for corners in transfmd_corners_list]
+    rights = [min(corners[1, 0], corners[2, 0]) for corners in transfmd_corners_list]
+
+    if stitch_direc == 1:
+        x_start, x_end = lefts[0], rights[-1]
+        y_start, y_end = max(tops), min(bottoms)
+    else:
+        x_start, x_end = max(lefts), min(rights)
+        y_start, y_end = tops[0], bottoms[-1]
+    return int(np.ceil(x_start)), int(np.ceil(y_start)), int(x_end), int(y_end)
+
+
+def warp_image_into_canvas(canvas, img, h_mat, blend=None, coverage=None, blender=None):
+
+    canvas_h, canvas_w = canvas.shape[:2]
+    img_h, img_w = img.shape[:2]
+    transfmd_corners = transform_with_homography(h_mat, get_corners_as_array(img_h, img_w))
+
+    x_start = max(0, int(np.floor(transfmd_corners[:, 0].min())) - 1)
+    y_start = max(0, int(np.floor(transfmd_corners[:, 1].min())) - 1)
+    x_end = min(canvas_w, int(np.ceil(transfmd_corners[:, 0].max())) + 2)
+    y_end = min(canvas_h, int(np.ceil(transfmd_corners[:, 1].max())) + 2)
+    if x_end <= x_start or y_end <= y_start:
+        return
+
+    # Only the bounding box of the warped image is resampled, not the whole canvas.
+    roi_h_mat = np.matmul(get_translation_matrix(-x_start, -y_start), h_mat)
+    roi_size = (x_end - x_start, y_end - y_start)
+    warped = cv2.warpPerspective(img, roi_h_mat, roi_size)
+    valid_mask = warp_mask_into_box(img.shape, h_mat, (x_start, y_start, x_end, y_end))
+
+    canvas_roi = canvas[y_start:y_end, x_start:x_end]
+    if blend is None or coverage is None:
+        np.copyto(canvas_roi, warped, where=(valid_mask > 0)[:, :, np.newaxis])
+        return
+
+    # The image being painted is the one on top (dst); what the canvas already
+    # holds is blended in, restricted to the bounding box of the overlap.
+    coverage_roi = coverage[y_start:y_end, x_start:x_end]
+    box_x, box_y, box_w, box_h = cv2.boundingRect(cv2.bitwise_and(valid_mask, coverage_roi))
+    under = None
+    if box_w > 0 and box_h > 0:
+        box_x_start, box_y_start = max(0, box_x - 1), max(0, box_y - 1)
+        box_x_end, box_y_end = min(roi_size[0], box_x + box_w + 1), min(roi_size[1], box_y + box_h + 1)
+        box = (slice(box_y_start, box_y_end), slice(box_x_start, box_x_end))
+        under = canvas_roi[box].copy()
+
+    np.copyto(canvas_roi, warped, where=(valid_mask > 0)[:, :, np.newaxis])
+    if under is not None:
+        blending.blend_overlap(canvas_roi[box], valid_mask[box], under, coverage_roi[box], blend, blender)
+    np.bitwise_or(coverage_roi, valid_mask, out=coverage_roi)
+
+
+def render_images_to_canvas(imgs, h_mats, crop_box, blend=None):
+
+    x_start, y_start, x_end, y_end = crop_box
+    canvas = None
+    coverage = None
+    blender = blending.MultiBandBlender() if blend == "multiband" else None
+    offset_h_mat = get_translation_matrix(-x_start, -y_start)
+
+    # Earlier images end up on top, as with the incremental stitch where img_a
+    # overwrites the warped img_b. Paths are decoded one at a time.
+    for img, h_mat in zip(reversed(imgs), reversed(h_mats)):
+        if isinstance(img, str):
+            img = cv2.imread(img)
+        if canvas is None:
+            canvas = np.zeros((y_end - y_start, x_end - x_start, img.shape[2]), dtype=img.dtype)
+            if blend is not None:
+                coverage = np.zeros(canvas.shape[:2], dtype=np.uint8)
+        warp_image_into_canvas(canvas, img, np.matmul(offset_h_mat, h_mat), blend=blend, coverage=coverage,
+                               blender=blender)
+    return canvas
+
+
+def get_largest_rect_in_grid(valid_grid):
+
+    # Maximal rectangle via a per-row histogram of consecutive valid cells and a
+    # monotonic stack, linear in the number of cells.
+    grid_h, grid_w = valid_grid.shape
+    heights = np.zeros(grid_w, dtype=np.int64)
+    best_area = 0
+    best_rect = (0, 0, 0, 0)
+
+    for row in range(grid_h):
+        heights = np.where(valid_grid[row], heights + 1, 0)
+        row_heights = heights.tolist() + [0]
+        stack = []
+        for col, height in enumerate(row_heights):
+            start = col
+            while stack and stack[-1][1] >= height:
+                start, top_height = stack.pop()
+                area = top_height * (col - start)
+                if area > best_area:
+                    best_area = area
+                    best_rect = (start, row - top_height + 1, col - start, top_height)
+            stack.append((start, height))
+    return best_rect
+
+
+def get_largest_valid_rect(valid_mask, max_side=256):
+
+    mask_h, mask_w = valid_mask.shape[:2]
+    valid = (valid_mask > 0).astype(np.uint8)
+    scale = min(1.0, float(max_side) / max(mask_h, mask_w))
+
+    # The search runs on a downscaled grid where a cell only counts as valid if
+    # it is entirely valid, then the result is refined at full resolution.
+    if scale < 1.0:
+        grid_w = max(1, int(mask_w * scale))
+        grid_h = max(1, int(mask_h * scale))
+        valid_grid = cv2.resize(valid * 255, (grid_w, grid_h), interpolation=cv2.INTER_AREA) == 255
+    else:
+        grid_h, grid_w = mask_h, mask_w
+        valid_grid = valid > 0
+    grid_x, grid_y, grid_rect_w, grid_rect_h = get_largest_rect_in_grid(valid_grid)
+    if grid_rect_w == 0 or grid_rect_h == 0:
+        return 0, 0, 0, 0
+
+    x_start = int(np.ceil(grid_x * mask_w / float(grid_w)))
+    y_start = int(np.ceil(grid_y * mask_h / float(grid_h)))
+    x_end = min(mask_w, int((grid_x + grid_rect_w) * mask_w / float(grid_w)))
+    y_end = min(mask_h, int((grid_y + grid_rect_h) * mask_h / float(grid_h)))
+
+    integral = cv2.integral(valid)
+
+    def all_valid(x0, y0, x1, y1):
+        if x1 <= x0 or y1 <= y0:
+            return False
+        total = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+        return total == (x1 - x0) * (y1 - y0)
+
+    while x_end > x_start and y_end > y_start and not all_valid(x_start, y_start, x_end, y_end):
+        x_start, y_start, x_end, y_end = x_start + 1, y_start + 1, x_end - 1, y_end - 1
+    if x_end <= x_start or y_end <= y_start:
+        return 0, 0, 0, 0
+
+    grown = True
+    while grown:
+        grown = False
+        if x_start > 0 and all_valid(x_start - 1, y_start, x_start, y_end):
+            x_start -= 1
+            grown = True
+        if x_end < mask_w and all_valid(x_end, y_start, x_end + 1, y_end):
+            x_end += 1
+            grown = True
+        if y_start > 0 and all_valid(x_start, y_start - 1, x_end, y_start):
+            y_start -= 1
+            grown = True
+        if y_end < mask_h and all_valid(x_start, y_end, x_end, y_end + 1):
+            y_end += 1
+            grown = True
+    return x_start, y_start, x_end - x_start, y_end - y_start
+
+
+def crop_to_valid_region(img, max_side=256):
+
+    if img.ndim == 3:
+        valid_mask = np.any(img > 0, axis=2)
+    else:
+        valid_mask = img > 0
+    x, y, w, h = get_largest_valid_rect(valid_mask.astype(np.uint8), max_side=max_side)
+    return img[y:y + h, x:x + w]
+
+
+def sniff_image_format(full_file_path):
+
+    with open(full_file_path, "rb") as img_file:
+        header = img_file.read(IMAGE_HEADER_LENGTH)
+    for signature, img_format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return img_format
+    return None
+
+
+def hash_file(full_file_path):
+
+    with open(full_file_path, "rb") as img_file:
+        return hashlib.sha1(img_file.read()).hexdigest()
 
 
 def check_imgfile_validity(folder, filenames):
 
+    # Files are recognised by their leading magic bytes, not by their extension.
     for file in filenames:
         full_file_path = os.path.join(folder, file)
-        regex = "([^\\s]+(\\.(?i:(jpe?g|png)))$)"
-        p = re.compile(regex)
 
         if not os.path.isfile(full_file_path):
             return False, "File not found: " + full_file_path
-        if not (re.search(p, file)):
+        if sniff_image_format(full_file_path) is None:
             return False, "Invalid image file: " + file
     return True, None
+
+
+def save_image_atomic(full_save_path, img):
+
+    # cv2.imwrite picks the encoder from the extension, so the temporary file
+    # keeps it; os.replace then publishes the finished file in one step.
+    folder, filename = os.path.split(os.path.abspath(full_save_path))
+    _, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(folder, "." + filename + "." + str(os.getpid()) + ".tmp" + ext)
+    try:
+        if not cv2.imwrite(tmp_path, img):
+            raise IOError("Could not write image: " + full_save_path)
+        os.replace(tmp_path, full_save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
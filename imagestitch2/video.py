@@ -0,0 +1,339 @@
+from . import blending
+from . import exceptions
+from . import instrumentation
+from . import tiled
+from . import utils
+import os
+import cv2
+import numpy as np
+
+KEYFRAME_STEP = 0.3
+MOTION_WIDTH = 256
+CANVAS_FACTOR = 3
+VERTICAL_MARGIN = 0.25
+NUM_KEYPOINTS = 1000
+CROP_CELL = 8
+COPY_ROWS = 1024
+
+
+def read_frames(video_source):
+
+    # video_source is anything cv2.VideoCapture opens (a file path, a device
+    # index or a stream URL), or an iterable of BGR frames.
+    if not isinstance(video_source, (str, int)):
+        for frame in video_source:
+            yield frame
+        return
+
+    capture = cv2.VideoCapture(video_source)
+    if not capture.isOpened():
+        raise IOError("Could not open video source: " + str(video_source))
+    try:
+        while True:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+class MotionEstimator(object):
+
+    # Global translation between consecutive frames by phase correlation on a
+    # small grey copy; cheap enough to run on every frame of the stream.
+    def __init__(self, frame_shape, motion_width=MOTION_WIDTH):
+        frame_h, frame_w = frame_shape[:2]
+        self.scale = min(1.0, float(motion_width) / frame_w)
+        self.size = (max(8, int(round(frame_w * self.scale))), max(8, int(round(frame_h * self.scale))))
+        self.window = cv2.createHanningWindow(self.size, cv2.CV_32F)
+        self.prev = None
+
+    def prepare(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return np.float32(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+
+    def update(self, frame):
+        # Returns how far the new frame's content lies along +x/+y from the
+        # previous frame's, in full-resolution pixels.
+        current = self.prepare(frame)
+        if self.prev is None:
+            self.prev = current
+            return 0.0, 0.0
+        (shift_x, shift_y), _ = cv2.phaseCorrelate(self.prev, current, self.window)
+        self.prev = current
+        return -shift_x / self.scale, -shift_y / self.scale
+
+
+class RollingCanvas(object):
+
+    # Fixed-size canvas that slides along x. Columns left of the newest
+    # keyframe can no longer be painted by a forward sweep, so they are handed
+    # out as finished strips and the canvas contents are shifted left.
+    def __init__(self, frame_shape, canvas_factor=CANVAS_FACTOR, vertical_margin=VERTICAL_MARGIN, blend=None):
+        frame_h, frame_w = frame_shape[:2]
+        self.margin_y = int(round(vertical_margin * frame_h))
+        shape = (frame_h + 2 * self.margin_y, canvas_factor * frame_w) + tuple(frame_shape[2:])
+        self.canvas = np.zeros(shape, dtype=np.uint8)
+        self.coverage = np.zeros(shape[:2], dtype=np.uint8) if blend is not None else None
+        self.origin_x = 0
+        self.painted_x = 0
+        self.blend = blend
+
+    def get_canvas_h_mat(self, h_mat):
+        return np.matmul(utils.get_translation_matrix(-self.origin_x, self.margin_y), h_mat)
+
+    def paint(self, frame, h_mat, blender=None):
+        canvas_h_mat = self.get_canvas_h_mat(h_mat)
+        frame_h, frame_w = frame.shape[:2]
+        corners = utils.transform_with_homography(canvas_h_mat, utils.get_corners_as_array(frame_h, frame_w))
+        utils.warp_image_into_canvas(self.canvas, frame, canvas_h_mat, blend=self.blend, coverage=self.coverage,
+                                     blender=blender)
+        self.painted_x = max(self.painted_x, min(self.canvas.shape[1], int(np.ceil(corners[:, 0].max()))))
+        return int(np.floor(corners[:, 0].min()))
+
+    def flush(self, flush_x):
+        flush_x = int(max(0, min(flush_x, self.painted_x)))
+        if flush_x == 0:
+            return None
+        strip = self.canvas[:, 0:flush_x].copy()
+        self.canvas[:, 0:-flush_x] = self.canvas[:, flush_x:]
+        self.canvas[:, -flush_x:] = 0
+        if self.coverage is not None:
+            self.coverage[:, 0:-flush_x] = self.coverage[:, flush_x:]
+            self.coverage[:, -flush_x:] = 0
+        self.origin_x += flush_x
+        self.painted_x -= flush_x
+        return strip
+
+
+def register_keyframes(prev_keyframe, keyframe, fallback_shift, adaptive_ransac=True, recorder=None):
+
+    # Homography of keyframe onto prev_keyframe. When features do not give a
+    # confident homography the phase correlation translation is used instead.
+    prev_points, prev_desc = prev_keyframe
+    points, desc = keyframe
+    recorder = instrumentation.get_recorder(recorder)
+    try:
+        with recorder.stage("match"):
+            matches_a, matches_b = utils.match_features(prev_points, prev_desc, points, desc)
+        with recorder.stage("ransac"):
+            return utils.compute_homography_ransac(matches_a, matches_b, adaptive=adaptive_ransac)
+    except (exceptions.NotEnoughMatchPointsError, exceptions.MatchesNotConfident):
+        recorder.set(motion_fallback=True)
+        return utils.get_translation_matrix(*fallback_shift)
+
+
+def orient_strip(strip, stitch_direction, sweep_sign):
+
+    # Undoes the mirroring and transposing that put a strip in the sweep frame.
+    if sweep_sign < 0:
+        strip = cv2.flip(strip, 1)
+    return strip if stitch_direction == 1 else cv2.transpose(strip)
+
+
+def stitch_video_strips(video_source, stitch_direction=1, keyframe_step=KEYFRAME_STEP, resize=1.0,
+                        adaptive_ransac=True, canvas_factor=CANVAS_FACTOR, blend=None, recorder=None):
+
+    # Generator over (strip, sweep_sign) in the sweep frame: frames are
+    # transposed for vertical sweeps and mirrored for sweeps towards -x, so the
+    # canvas always rolls forward. The sign is taken from the motion up to the
+    # first keyframe step; until then the first frame is held back.
+    recorder = instrumentation.get_recorder(recorder)
+    motion = None
+    canvas = None
+    blender = None
+    prev_keyframe = None
+    global_h_mat = None
+    first = None
+    pending = None
+    sweep_sign = None
+    step = None
+
+    for frame_index, frame in enumerate(read_frames(video_source)):
+        if resize != 1.0:
+            frame = cv2.resize(frame, None, fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+        if stitch_direction == 0:
+            # Vertical sweeps run through the same code on transposed frames.
+            frame = cv2.transpose(frame)
+
+        if motion is None:
+            motion = MotionEstimator(frame.shape)
+            canvas = RollingCanvas(frame.shape, canvas_factor=canvas_factor, blend=blend)
+            if blend == "multiband":
+                blender = blending.MultiBandBlender()
+            step = keyframe_step * frame.shape[1]
+            accumulated = np.zeros(2)
+
+        with recorder.stage("motion"):
+            accumulated += motion.update(frame)
+        if first is None:
+            first = (frame_index, frame)
+            continue
+        if sweep_sign is None:
+            if abs(accumulated[0]) < step:
+                pending = (frame_index, frame)
+                continue
+            sweep_sign = 1 if accumulated[0] > 0 else -1
+            prev_keyframe, global_h_mat, _ = add_keyframe(mirror_frame(first[1], sweep_sign), first[0], np.zeros(2),
+                                                          canvas, None, None, adaptive_ransac, blender, recorder)
+        if accumulated[0] * sweep_sign < step:
+            pending = (frame_index, frame)
+            continue
+
+        pending = None
+        prev_keyframe, global_h_mat, strip = add_keyframe(mirror_frame(frame, sweep_sign), frame_index,
+                                                          accumulated * [sweep_sign, 1], canvas, prev_keyframe,
+                                                          global_h_mat, adaptive_ransac, blender, recorder)
+        accumulated[:] = 0
+        if strip is not None:
+            yield strip, sweep_sign
+
+    if canvas is None:
+        return
+    # The last frame is always painted, so the end of the sweep is not lost.
+    if sweep_sign is None:
+        sweep_sign = -1 if accumulated[0] < 0 else 1
+        prev_keyframe, global_h_mat, _ = add_keyframe(mirror_frame(first[1], sweep_sign), first[0], np.zeros(2),
+                                                      canvas, None, None, adaptive_ransac, blender, recorder)
+    if pending is not None and accumulated[0] * sweep_sign > 0:
+        prev_keyframe, global_h_mat, strip = add_keyframe(mirror_frame(pending[1], sweep_sign), pending[0],
+                                                          accumulated * [sweep_sign, 1], canvas, prev_keyframe,
+                                                          global_h_mat, adaptive_ransac, blender, recorder)
+        if strip is not None:
+            yield strip, sweep_sign
+    strip = canvas.flush(canvas.painted_x)
+    if strip is not None:
+        yield strip, sweep_sign
+
+
+def mirror_frame(frame, sweep_sign):
+
+    return frame if sweep_sign > 0 else cv2.flip(frame, 1)
+
+
+def stitch_video(video_source, stitch_direction=1, keyframe_step=KEYFRAME_STEP, resize=1.0, adaptive_ransac=True,
+                 canvas_factor=CANVAS_FACTOR, blend=None, recorder=None):
+
+    # Generator over the finished strips of a panorama of a video sweep, in
+    # the order the sweep reaches them: left to right (top to bottom for
+    # stitch_direction 0), or right to left (bottom to top) when the camera
+    # moves the other way. A frame becomes a keyframe once the content has
+    # moved by keyframe_step frame widths since the previous keyframe; only
+    # keyframes are registered and painted. Memory use is bounded by the
+    # rolling canvas, whatever the length of the video.
+    for strip, sweep_sign in stitch_video_strips(video_source, stitch_direction, keyframe_step=keyframe_step,
+                                                 resize=resize, adaptive_ransac=adaptive_ransac,
+                                                 canvas_factor=canvas_factor, blend=blend, recorder=recorder):
+        yield orient_strip(strip, stitch_direction, sweep_sign)
+
+
+def add_keyframe(frame, frame_index, shift, canvas, prev_keyframe, global_h_mat, adaptive_ransac, blender, recorder):
+
+    recorder.begin("keyframe", frame=frame_index)
+    with recorder.stage("gray"):
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    with recorder.stage("detect"):
+        keyframe = utils.detect_features(frame_gray, NUM_KEYPOINTS)
+
+    if prev_keyframe is None:
+        global_h_mat = np.eye(3)
+    else:
+        h_mat = register_keyframes(prev_keyframe, keyframe, shift, adaptive_ransac, recorder)
+        global_h_mat = np.matmul(global_h_mat, h_mat)
+        global_h_mat /= global_h_mat[2, 2]
+
+    with recorder.stage("warp"):
+        left_x = canvas.paint(frame, global_h_mat, blender)
+    with recorder.stage("crop"):
+        strip = canvas.flush(left_x)
+    recorder.track_arrays(canvas.canvas, canvas.coverage, frame)
+    return keyframe, global_h_mat, strip
+
+
+class StripFile(object):
+
+    # Finished sweep-frame strips appended column by column to a raw file, so
+    # the panorama is assembled on disk. A validity grid of CROP_CELL sized
+    # cells, a cell counting only if all of its pixels are painted, is kept
+    # alongside for cropping.
+    def __init__(self, path, cell=CROP_CELL):
+        self.path = path
+        self.cell = cell
+        self.file = open(path, "wb")
+        self.length = 0
+        self.strip_shape = None
+        self.grid_columns = []
+        self.leftover = None
+
+    def append(self, strip):
+        if self.strip_shape is None:
+            self.strip_shape = strip.shape[:1] + strip.shape[2:]
+        self.file.write(np.ascontiguousarray(np.swapaxes(strip, 0, 1)).tobytes())
+        self.length += strip.shape[1]
+
+        valid = strip > 0
+        if valid.ndim == 3:
+            valid = valid.any(axis=2)
+        num_rows = valid.shape[0] // self.cell
+        columns = valid[:num_rows * self.cell].reshape(num_rows, self.cell, -1).all(axis=1)
+        if self.leftover is not None:
+            columns = np.concatenate((self.leftover, columns), axis=1)
+        num_cells = columns.shape[1] // self.cell
+        self.grid_columns.append(columns[:, :num_cells * self.cell].reshape(num_rows, num_cells, self.cell).all(axis=2))
+        self.leftover = columns[:, num_cells * self.cell:]
+
+    def close(self):
+        self.file.close()
+
+    def get_valid_rect(self):
+        # (x, y, w, h) in the sweep frame, x along the sweep.
+        grid_x, grid_y, grid_w, grid_h = utils.get_largest_rect_in_grid(np.concatenate(self.grid_columns, axis=1))
+        return grid_x * self.cell, grid_y * self.cell, grid_w * self.cell, grid_h * self.cell
+
+    def open_memmap(self):
+        # Indexed [position along the sweep, position across it].
+        return np.memmap(self.path, dtype=np.uint8, mode="r", shape=(self.length,) + self.strip_shape)
+
+
+def stitch_video_and_save(video_source, output_path, stitch_direction=1, keyframe_step=KEYFRAME_STEP, resize=1.0,
+                          adaptive_ransac=True, blend=None, recorder=None):
+
+    # Strips are appended to a temporary file next to output_path as they are
+    # finished, and the panorama is cropped out of its memory map. A .npy
+    # output_path is written as a memory map as well, so no step holds the
+    # whole panorama; image formats are encoded from one in-memory copy.
+    folder, filename = os.path.split(os.path.abspath(output_path))
+    strip_file = StripFile(os.path.join(folder, "." + filename + "." + str(os.getpid()) + ".strips"))
+    try:
+        sweep_sign = 1
+        for strip, sweep_sign in stitch_video_strips(video_source, stitch_direction, keyframe_step=keyframe_step,
+                                                     resize=resize, adaptive_ransac=adaptive_ransac, blend=blend,
+                                                     recorder=recorder):
+            strip_file.append(strip)
+        strip_file.close()
+        if strip_file.length == 0:
+            raise exceptions.InsufficientImagesError(0)
+
+        x, y, w, h = strip_file.get_valid_rect()
+        sweep = strip_file.open_memmap()
+        if sweep_sign < 0:
+            sweep = sweep[::-1]
+            x = strip_file.length - x - w
+        panorama = sweep[x:x + w, y:y + h]
+        if stitch_direction == 1:
+            panorama = np.swapaxes(panorama, 0, 1)
+
+        if output_path.lower().endswith(".npy"):
+            output = tiled.open_output_memmap(output_path, panorama.shape)
+            for row in range(0, panorama.shape[0], COPY_ROWS):
+                output[row:row + COPY_ROWS] = panorama[row:row + COPY_ROWS]
+            output.flush()
+            return output
+        panorama = np.ascontiguousarray(panorama)
+        utils.save_image_atomic(output_path, panorama)
+        return panorama
+    finally:
+        strip_file.close()
+        if os.path.exists(strip_file.path):
+            os.remove(strip_file.path)
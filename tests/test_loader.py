@@ -0,0 +1,42 @@
+import struct
+import cv2
+import numpy as np
+import pytest
+from imagestitch2 import features
+from imagestitch2 import loader
+
+
+def make_exif_app1(orientation, byte_order):
+
+    fmt = "<" if byte_order == b"II" else ">"
+    tiff = (byte_order + struct.pack(fmt + "HI", 42, 8) + struct.pack(fmt + "H", 1) +
+            struct.pack(fmt + "HHIHH", loader.EXIF_ORIENTATION_TAG, 3, 1, orientation, 0) + struct.pack(fmt + "I", 0))
+    payload = b"Exif\0\0" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def write_oriented_jpeg(path, orientation, byte_order=b"II"):
+
+    rng = np.random.RandomState(0)
+    img = cv2.GaussianBlur(rng.randint(0, 256, (301, 517, 3), dtype=np.uint8), (0, 0), 3)
+    data = cv2.imencode(".jpg", img)[1].tobytes()
+    # The APP1 segment goes right after the SOI marker.
+    with open(path, "wb") as img_file:
+        img_file.write(data[:2] + make_exif_app1(orientation, byte_order) + data[2:])
+    return str(path)
+
+
+@pytest.mark.parametrize("byte_order", [b"II", b"MM"])
+@pytest.mark.parametrize("orientation", [1, 3, 6, 8])
+def test_read_image_size_follows_exif_orientation(tmp_path, orientation, byte_order):
+
+    img_path = write_oriented_jpeg(tmp_path / "img.jpg", orientation, byte_order)
+    assert loader.read_image_size(img_path) == cv2.imread(img_path).shape[:2]
+
+
+@pytest.mark.parametrize("scale", [2, 4])
+def test_reduced_features_keep_decoded_shape_of_rotated_jpeg(tmp_path, scale):
+
+    img_path = write_oriented_jpeg(tmp_path / "img.jpg", 6)
+    img_features = features.detect_image_features(img_path, scale=scale)
+    assert img_features.img_shape == cv2.imread(img_path).shape
@@ -0,0 +1,63 @@
+import importlib.util
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("imutils")
+
+PEOPLE_COUNT_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "Advanced Projects", "Real Time People Count")
+PERSON_SIZE = (60, 200)
+PERSON_COLOUR = (40, 40, 230)
+
+
+def load_people_count():
+
+    sys.path.insert(0, PEOPLE_COUNT_DIR)
+    spec = importlib.util.spec_from_file_location("people_count_main", os.path.join(PEOPLE_COUNT_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class BlobDetector(object):
+
+    # Stands in for the HOG people detector: finds the uniformly coloured
+    # people, but only when most of one lies inside the searched crop.
+    def detectMultiScale(self, frame, **kwargs):
+        mask = ((frame[:, :, 2] > 200) & (frame[:, :, 0] < 60)).astype(np.uint8)
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        found = [stats[i, :4] for i in range(1, num_labels)
+                 if stats[i, 4] >= 0.8 * PERSON_SIZE[0] * PERSON_SIZE[1]]
+        return np.array(found, dtype=int).reshape(-1, 4), np.ones(len(found))
+
+
+def write_corridor_clip(path, num_frames=160):
+
+    # Plain clothing on a plain background: moving 2 px per frame, a person
+    # only changes thin slivers along their top and bottom edges.
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (800, 600))
+    for i in range(num_frames):
+        frame = np.full((600, 800, 3), 90, dtype=np.uint8)
+        y = 20 + 2 * i
+        frame[y:y + PERSON_SIZE[1], 650:650 + PERSON_SIZE[0]] = PERSON_COLOUR
+        x = 50 + 3 * i
+        frame[200:200 + PERSON_SIZE[1], x:x + PERSON_SIZE[0]] = PERSON_COLOUR
+        writer.write(frame)
+    writer.release()
+    return num_frames
+
+
+@pytest.mark.parametrize("detect_every", [1, 3])
+def test_motion_gate_counts_match_ungated(tmp_path, detect_every):
+
+    main = load_people_count()
+    main.HOGCV = BlobDetector()
+    path = str(tmp_path / "corridor.avi")
+    num_frames = write_corridor_clip(path)
+
+    ungated = main.countPeopleInRange(path, 0, num_frames, detectEvery=detect_every)
+    gated = main.countPeopleInRange(path, 0, num_frames, motionGate=True, detectEvery=detect_every)
+    assert gated[1:3] == ungated[1:3] == (1, 0)
+    assert [record["count"] for record in gated[0]] == [record["count"] for record in ungated[0]]